@@ -1,5 +1,9 @@
+import asyncio
 import os
-from typing import TypedDict, Annotated, List
+import sys
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Mapping, TypedDict, Annotated, List
 from dotenv import load_dotenv
 
 from langchain_openai import ChatOpenAI
@@ -9,6 +13,11 @@ from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.sqlite_cache import SQLiteCache
+from core.http_clients import get_http_client, get_async_http_client
+
 # -------------------------------------------------
 # 1. 環境設定
 # -------------------------------------------------
@@ -39,7 +48,16 @@ tools = [multiply, get_weather]
 # 3. LLM とツールのバインディング
 # -------------------------------------------------
 # LLM に「これらのツールを使っていいよ」と教える
-llm = ChatOpenAI(model="gpt-4o-mini")
+# prompt_cache_key: 先頭部分（ツール定義 + 会話の冒頭）が同じリクエストを OpenAI 側の同じキャッシュに振り分け、
+# プロンプトキャッシュ（1024トークン以上の共通プレフィックスを再利用する仕組み）に当たりやすくします
+llm = ChatOpenAI(
+    model="gpt-4o-mini",
+    cache=SQLiteCache(),
+    model_kwargs={"prompt_cache_key": "tool_bot_v1"},
+    http_client=get_http_client(),
+    http_async_client=get_async_http_client(),
+)
+# tools は固定の順番で渡すので、リクエストごとのツール定義（プロンプトの先頭部分）は常に同じになります
 llm_with_tools = llm.bind_tools(tools)
 
 # -------------------------------------------------
@@ -51,24 +69,50 @@ class State(TypedDict):
 # -------------------------------------------------
 # 5. ノード定義
 # -------------------------------------------------
-def chatbot(state: State):
+async def chatbot(state: State):
     """LLM を実行するノード。
     ツールが必要ならツール呼び出し（tool_calls）を含むメッセージを返し、
     不要なら普通のテキストを返します。
+    グラフは ainvoke で同時に実行するので、LLM も ainvoke で呼び出してイベントループを止めないようにします。
     """
-    return {"messages": [llm_with_tools.invoke(state["messages"])]}
+    return {"messages": [await llm_with_tools.ainvoke(state["messages"])]}
 
 # ToolNode は LangGraph が用意している「ツール実行用ノード」です。
 # tool_calls を含むメッセージを受け取ると、自動でツールを実行して ToolMessage を返します。
 tool_node = ToolNode(tools)
 
+# ツール名 → 本体の Python 関数 の対応表
+# ツール構成は固定なので起動時に1回だけ作り、以後は読み取り専用 (MappingProxyType) で使い回します
+TOOL_FUNCS: Mapping[str, Callable[..., Any]] = MappingProxyType({t.name: t.func for t in tools})
+
+def run_tools(state: State):
+    """ToolNode の軽量版（自前のツール実行ノード）。
+    tool.invoke を経由せず、対応表から取り出した関数を直接呼び出すので、
+    pydantic による引数の検証やコールバック処理を省けます。
+    その代わり引数の型チェックは行われないため、中身が単純で信頼できるツールにだけ使ってください。
+    """
+    results = []
+    for call in state["messages"][-1].tool_calls:
+        func = TOOL_FUNCS.get(call["name"])
+        if func is None:
+            content = f"Error: {call['name']} is not a valid tool, try one of [{', '.join(TOOL_FUNCS)}]."
+        else:
+            try:
+                content = str(func(**call["args"]))
+            except Exception as e:
+                # ToolNode と同じく、例外はエラーメッセージとして LLM に返して直させる
+                content = f"Error: {e!r}\n Please fix your mistakes."
+        results.append(ToolMessage(content=content, name=call["name"], tool_call_id=call["id"]))
+    return {"messages": results}
+
 # -------------------------------------------------
 # 6. グラフ構築
 # -------------------------------------------------
 builder = StateGraph(State)
 
 builder.add_node("chatbot", chatbot)
-builder.add_node("tools", tool_node)
+# FAST_TOOLS=1 のときは ToolNode の代わりに自前の run_tools を使う（ノード名は同じ "tools"）
+builder.add_node("tools", run_tools if os.getenv("FAST_TOOLS") == "1" else tool_node)
 
 builder.add_edge(START, "chatbot")
 
@@ -82,50 +126,45 @@ builder.add_conditional_edges(
 
 builder.add_edge("tools", "chatbot") # ツール実行後は必ず chatbot に戻る（結果を踏まえて回答させるため）
 
+# グラフのコンパイルと bind_tools はモジュール読み込み時に1回だけ行われます。
+# 他のアプリ（Web サーバーなど）から import した場合も、同じ graph を使い回してください。
 graph = builder.compile()
 
 # -------------------------------------------------
 # 7. 実行
 # -------------------------------------------------
-if __name__ == "__main__":
+async def main():
     print("--- ToolNode Bot 開始 ---")
-    
-    # ケース1: 普通の会話
-    print("\n[User] こんにちは")
-    for event in graph.stream({"messages": [HumanMessage(content="こんにちは")]}):
-        for key, value in event.items():
-            print(f"[{key}] {value['messages'][-1].content}")
-
-    # ケース2: 計算（ツール利用）
-    print("\n[User] 123 * 456 は？")
-    # 前回の会話を引き継がないように新しい State で開始
-    for event in graph.stream({"messages": [HumanMessage(content="123 * 456 は？")]}):
-        for key, value in event.items():
-            # ToolNode の出力は ToolMessage なので content はツールの実行結果
-            msg = value['messages'][-1]
-            if isinstance(msg, ToolMessage):
-                print(f"[{key}] Tool Output: {msg.content}")
-            else:
-                print(f"[{key}] {msg.content}")
-
-    # ケース3: 天気（ツール利用）
-    print("\n[User] 大阪の天気は？")
-    for event in graph.stream({"messages": [HumanMessage(content="大阪の天気は？")]}):
-        for key, value in event.items():
-            msg = value['messages'][-1]
-            if isinstance(msg, ToolMessage):
-                print(f"[{key}] Tool Output: {msg.content}")
-            else:
-                print(f"[{key}] {msg.content}")
-
-    # ケース4: 複雑な計算を実行
-    print("\n [User] 1000の階乗 ($1000!$) の末尾に連続してゼロがいくつ並びますか？また、$1000!$ の最上位の桁はいくつですか？(正確な答えが出ないかな)")
-    for event in graph.stream({"messages": [HumanMessage(content="1000の階乗 ($1000!$) の末尾に連続してゼロがいくつ並びますか？また、$1000!$ の最上位の桁はいくつですか？")]}):
-        for key, value in event.items():
-            msg = value['messages'][-1]
-            if isinstance(msg, ToolMessage):
-                print(f"[{key}] Tool Output: {msg.content}")
+
+    # 各ケースは互いに独立した会話なので、まとめて同時に実行します
+    # （合計の待ち時間が「全ケースの合計」ではなく「最も遅いケース1つ分」になる）
+    test_cases = [
+        ("こんにちは", "こんにちは"),
+        ("123 * 456 は？", "123 * 456 は？"),
+        ("大阪の天気は？", "大阪の天気は？"),
+        (
+            "1000の階乗 ($1000!$) の末尾に連続してゼロがいくつ並びますか？また、$1000!$ の最上位の桁はいくつですか？(正確な答えが出ないかな)",
+            "1000の階乗 ($1000!$) の末尾に連続してゼロがいくつ並びますか？また、$1000!$ の最上位の桁はいくつですか？",
+        ),
+    ]
+
+    # 前回の会話を引き継がないように、ケースごとに新しい State で開始
+    results = await asyncio.gather(*(
+        graph.ainvoke({"messages": [HumanMessage(content=prompt)]})
+        for _, prompt in test_cases
+    ))
+
+    for (label, _), result in zip(test_cases, results):
+        print(f"\n[User] {label}")
+        # 先頭はユーザーの入力なので、それ以降（chatbot / tools の出力）を順に表示
+        for msg in result["messages"][1:]:
+            # ToolNode の出力は ToolMessage (type == "tool") なので content はツールの実行結果
+            if msg.type == "tool":
+                print(f"[tools] Tool Output: {msg.content}")
             else:
-                print(f"[{key}] {msg.content}")
+                print(f"[chatbot] {msg.content}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
 
 #print(graph.get_graph().print_ascii())
\ No newline at end of file
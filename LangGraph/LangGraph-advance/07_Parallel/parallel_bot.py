@@ -1,5 +1,8 @@
 import asyncio
 import operator
+import sys
+from functools import lru_cache
+from pathlib import Path
 from typing import TypedDict, Annotated, List, Optional
 from dotenv import load_dotenv
 
@@ -8,13 +11,32 @@ from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, START, END
 
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.http_clients import get_http_client, get_async_http_client
+
 # -------------------------------------------------
 # 1. 環境設定
 # -------------------------------------------------
 load_dotenv()
 
-# デフォルトの LLM（設定がない場合に使用）
-default_llm = ChatOpenAI(model="gpt-4o-mini")
+@lru_cache(maxsize=8)
+def get_llm(model_name: str) -> ChatOpenAI:
+    """モデル名ごとに ChatOpenAI を1つだけ生成して使い回す。
+    クライアントの生成コストを省き、HTTP 接続もリクエスト間で再利用されます。
+    """
+    return ChatOpenAI(
+        model=model_name,
+        # prompt_cache_key: 先頭部分（システムプロンプト）が同じリクエストを OpenAI 側の同じキャッシュに振り分け、
+        # プロンプトキャッシュに当たりやすくします（LLM を呼ぶのは aggregator だけなので、キーは1つで足ります）
+        model_kwargs={"prompt_cache_key": "parallel_bot_aggregator"},
+        # すべての LLM で1つの HTTP/2 クライアント（接続プール）を共有する
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+# デフォルトの LLM（設定がない場合に使用）。起動時に生成しておく
+default_llm = get_llm("gpt-4o-mini")
 
 # -------------------------------------------------
 # 2. State 定義
@@ -46,6 +68,15 @@ async def search_blogs(state: State):
     await asyncio.sleep(1)
     return {"results": [f"Blog Result for '{state['query']}'"]}
 
+async def gather_searches(state: State):
+    """3つの検索を1つのノード内で同時に実行する。
+    ノードを3つに分けて Fan-out するよりも、スケジューラの切り替えや
+    Reducer（operator.add）の呼び出しが1回で済みます。
+    """
+    searches = (search_wikipedia, search_news, search_blogs)
+    outputs = await asyncio.gather(*(search(state) for search in searches))
+    return {"results": [r for output in outputs for r in output["results"]]}
+
 def aggregator(state: State, config: RunnableConfig):
     """すべての検索結果をまとめて回答を生成する。
     config からモデル名やシステムプロンプトを動的に取得します。
@@ -59,16 +90,17 @@ def aggregator(state: State, config: RunnableConfig):
     
     print(f"  [Config] Model: {model_name}, System: {system_prompt[:20]}...")
 
-    # 2. 設定に基づいて LLM を準備
-    # ※ 頻繁に呼び出す場合はキャッシュする等の工夫も考えられますが、今回は都度生成します
-    llm = ChatOpenAI(model=model_name)
+    # 2. 設定に基づいて LLM を準備（同じモデル名ならキャッシュ済みのインスタンスを使う）
+    llm = get_llm(model_name)
 
     results_text = "\n".join(state["results"])
     
     # 3. メッセージの構築（システムプロンプトを追加）
+    # システムプロンプトは加工せずそのまま先頭に置き、変わる部分（質問・検索結果）は後ろに回します。
+    # 先頭が毎回同じだと OpenAI のプロンプトキャッシュが効きやすくなります
     messages = [
         SystemMessage(content=system_prompt),
-        HumanMessage(content=f"以下の情報を元に、質問「{state['query']}」に回答してください。\n\n情報:\n{results_text}")
+        HumanMessage(content=f"以下の情報を元に、質問に回答してください。\n\n情報:\n{results_text}\n\n質問: {state['query']}")
     ]
     
     response = llm.invoke(messages)
@@ -79,19 +111,12 @@ def aggregator(state: State, config: RunnableConfig):
 # -------------------------------------------------
 builder = StateGraph(State)
 
-builder.add_node("wikipedia", search_wikipedia)
-builder.add_node("news", search_news)
-builder.add_node("blogs", search_blogs)
+# 3つの検索は gather_searches ノードの中で asyncio.gather により並列実行します
+builder.add_node("searches", gather_searches)
 builder.add_node("aggregator", aggregator)
 
-builder.add_edge(START, "wikipedia")
-builder.add_edge(START, "news")
-builder.add_edge(START, "blogs")
-
-builder.add_edge("wikipedia", "aggregator")
-builder.add_edge("news", "aggregator")
-builder.add_edge("blogs", "aggregator")
-
+builder.add_edge(START, "searches")
+builder.add_edge("searches", "aggregator")
 builder.add_edge("aggregator", END)
 
 graph = builder.compile()
@@ -106,9 +131,9 @@ async def main():
     
     # ケース1: デフォルト設定（gpt-4o-mini, 標準プロンプト）
     print("\n=== Case 1: Default Config ===")
-    async for event in graph.astream_events(initial_state, version="v1"):
-        if event["event"] == "on_chain_end" and event["name"] == "aggregator":
-            print(f"\n[Final Answer]\n{event['data']['output']['answer']}")
+    # 最終的な回答だけが必要なので、イベントを逐次受け取る astream_events ではなく ainvoke を使います
+    result = await graph.ainvoke(initial_state)
+    print(f"\n[Final Answer]\n{result['answer']}")
 
     # ケース2: カスタム設定（関西弁プロンプト）
     # ※ モデルは同じですが、プロンプトが変わります
@@ -120,9 +145,8 @@ async def main():
         }
     }
     # state は使い回さず、新しい state で実行します（results が重複しないように）
-    async for event in graph.astream_events(initial_state, version="v1", config=config_kansai):
-        if event["event"] == "on_chain_end" and event["name"] == "aggregator":
-            print(f"\n[Final Answer]\n{event['data']['output']['answer']}")
+    result = await graph.ainvoke(initial_state, config=config_kansai)
+    print(f"\n[Final Answer]\n{result['answer']}")
 
     # ケース3: モデル切り替え（例: gpt-3.5-turbo）
     # ※ API キーや権限によっては gpt-4 が使えない場合もあるので、利用可能なモデルを指定してください
@@ -133,9 +157,8 @@ async def main():
             "system_message": "あなたは厳格な学者です。学術的な口調で答えてください。"
         }
     }
-    async for event in graph.astream_events(initial_state, version="v1", config=config_gpt35):
-        if event["event"] == "on_chain_end" and event["name"] == "aggregator":
-            print(f"\n[Final Answer]\n{event['data']['output']['answer']}")
+    result = await graph.ainvoke(initial_state, config=config_gpt35)
+    print(f"\n[Final Answer]\n{result['answer']}")
 
 if __name__ == "__main__":
     asyncio.run(main())
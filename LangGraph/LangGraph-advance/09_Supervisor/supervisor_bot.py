@@ -11,7 +11,10 @@ LLMのレスポンスを確実に構造化された形式で取得します。
 4. エラーハンドリングが明確
 """
 import asyncio
-from typing import TypedDict, Annotated, List, Literal
+import re
+import sys
+from pathlib import Path
+from typing import TypedDict, Annotated, List, Literal, Optional
 from enum import Enum
 from dotenv import load_dotenv
 
@@ -21,12 +24,35 @@ from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.llm_cache import SemanticCache
+from core.http_clients import get_http_client, get_async_http_client
+from core.sqlite_cache import SQLiteCache
+
 # -------------------------------------------------
 # 1. 環境設定
 # -------------------------------------------------
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o-mini")
+# 各エージェントの回答は、まったく同じ質問のときだけキャッシュから返します
+# （言い回しが似ていても、数字や固有名詞が違えば答えも変わるため）
+llm = ChatOpenAI(
+    model="gpt-4o-mini",
+    cache=SQLiteCache(),
+    http_client=get_http_client(),
+    http_async_client=get_async_http_client(),
+)
+
+# ルーティング（どのエージェントに任せるか）は言い回しが違うだけの質問なら同じになるので、
+# 意味的類似のキャッシュを使います（類似ヒットを使うのは temperature=0 の呼び出しだけです）
+router_llm = ChatOpenAI(
+    model="gpt-4o-mini",
+    temperature=0,
+    cache=SemanticCache(),
+    http_client=get_http_client(),
+    http_async_client=get_async_http_client(),
+)
 
 # -------------------------------------------------
 # 2. State 定義
@@ -56,78 +82,118 @@ class RoutingDecision(BaseModel):
 
 # Structured Output を使うようにLLMを設定
 # これにより、LLMは必ず RoutingDecision の形式で返すようになります
-structured_llm = llm.with_structured_output(RoutingDecision)
+# method="json_schema" + strict=True: ツール呼び出しを経由せず、OpenAI の response_format (Structured Outputs) に
+# スキーマを直接渡します。スキーマは毎回同じなので、OpenAI 側での準備は初回だけで済みます
+structured_llm = router_llm.with_structured_output(RoutingDecision, method="json_schema", strict=True)
 
 # -------------------------------------------------
 # 4. 専門エージェントの定義
 # -------------------------------------------------
 
-def question_agent(state: State):
+# システムプロンプトは毎回同じなので、モジュール読み込み時に1回だけ作って使い回します
+QUESTION_SYSTEM = SystemMessage(content="あなたは質問に答える専門家です。簡潔で分かりやすい回答を心がけてください。")
+CALCULATION_SYSTEM = SystemMessage(content="あなたは計算の専門家です。数式や計算問題を正確に解いてください。計算過程も示してください。")
+SEARCH_SYSTEM = SystemMessage(content="あなたは情報検索の専門家です。最新の情報や事実に基づいて回答してください。")
+
+async def question_agent(state: State):
     """質問に答える専門エージェント"""
     print("  [Question Agent] 質問に回答中...")
     
     user_query = state["messages"][-1].content
     
     messages = [
-        SystemMessage(content="あなたは質問に答える専門家です。簡潔で分かりやすい回答を心がけてください。"),
+        QUESTION_SYSTEM,
         HumanMessage(content=user_query)
     ]
     
-    response = llm.invoke(messages)
+    response = await llm.ainvoke(messages)
     return {"messages": [response]}
 
-def calculation_agent(state: State):
+async def calculation_agent(state: State):
     """計算を行う専門エージェント"""
     print("  [Calculation Agent] 計算を実行中...")
     
     user_query = state["messages"][-1].content
     
     messages = [
-        SystemMessage(content="あなたは計算の専門家です。数式や計算問題を正確に解いてください。計算過程も示してください。"),
+        CALCULATION_SYSTEM,
         HumanMessage(content=f"以下の計算を実行してください: {user_query}")
     ]
     
-    response = llm.invoke(messages)
+    response = await llm.ainvoke(messages)
     return {"messages": [response]}
 
-def search_agent(state: State):
+async def search_agent(state: State):
     """情報検索を行う専門エージェント（シミュレーション）"""
     print("  [Search Agent] 情報を検索中...")
     
     user_query = state["messages"][-1].content
     
     messages = [
-        SystemMessage(content="あなたは情報検索の専門家です。最新の情報や事実に基づいて回答してください。"),
+        SEARCH_SYSTEM,
         HumanMessage(content=f"以下のトピックについて、最新の情報を調べて回答してください: {user_query}")
     ]
     
-    response = llm.invoke(messages)
+    response = await llm.ainvoke(messages)
     return {"messages": [response]}
 
 # -------------------------------------------------
 # 5. Supervisor（スーパーバイザー）の定義
 # -------------------------------------------------
 
-def supervisor(state: State) -> dict:
-    """ユーザーの質問を分析し、適切なエージェントにルーティングする（Structured Output使用）"""
-    print("\n[Supervisor] 質問を分析中...")
-    
-    user_message = state["messages"][-1].content
-    
-    routing_prompt = f"""
+# 振り分けの指示は固定なのでシステムプロンプトにまとめ、最後のメッセージにはユーザーの質問だけを置きます
+# （router_llm の意味的類似キャッシュは最後のメッセージを埋め込むので、指示文ではなく質問そのものが比較されます）
+SUPERVISOR_SYSTEM = SystemMessage(content="""あなたは質問を分析して適切な専門家に振り分けるスーパーバイザーです。
 ユーザーの質問を読んで、どの専門エージェントに振り分けるべきか判断してください。
 
 利用可能なエージェント:
 1. question_agent: 一般的な質問に答える（例：「Pythonとは？」「AIとは？」「説明して」）
 2. calculation_agent: 計算や数式を解く（例：「123 * 456は？」「計算してください」「円の面積」）
-3. search_agent: 最新情報や事実を調べる（例：「2024年の最新技術」「最新のトレンド」「調べて」）
+3. search_agent: 最新情報や事実を調べる（例：「2024年の最新技術」「最新のトレンド」「調べて」）""")
 
-ユーザーの質問: {user_message}
-"""
+# ユーザーの質問文 → 振り分け先エージェント名
+# ルーティング結果は質問文だけで決まるので、同じ質問が来たら LLM（と埋め込みの計算）を省略します
+routing_cache: dict[str, str] = {}
+
+# キーワードだけで明らかに判断できる質問用のパターン（LLM を呼ばずに振り分ける）
+# "-" や "/" は日付（2024-01-05 など）と紛らわしいので、数式の演算子には含めていません
+SEARCH_PATTERN = re.compile(r"最新|20\d\d年|最近|トレンド|ニュース|調べて")
+CALCULATION_PATTERN = re.compile(r"\d\s*[+*×÷^]\s*\d|計算|面積|円周率|体積")
+
+def quick_route(text: str) -> Optional[AgentChoice]:
+    """キーワードで振り分け先が明らかな場合はそのエージェントを返す。
+    どちらにも当てはまらない、または両方に当てはまる（判断が分かれる）場合は None を返し、LLM に任せる。
+    """
+    is_search = SEARCH_PATTERN.search(text) is not None
+    is_calculation = CALCULATION_PATTERN.search(text) is not None
+    if is_search and not is_calculation:
+        return AgentChoice.SEARCH
+    if is_calculation and not is_search:
+        return AgentChoice.CALCULATION
+    return None
+
+async def supervisor(state: State) -> dict:
+    """ユーザーの質問を分析し、適切なエージェントにルーティングする（Structured Output使用）"""
+    print("\n[Supervisor] 質問を分析中...")
+    
+    user_message = state["messages"][-1].content
+
+    # 明らかなケースは LLM を呼ばずに即決する
+    quick_choice = quick_route(user_message)
+    if quick_choice is not None:
+        print(f"  [Supervisor] キーワードで判定: {quick_choice.value}")
+        print(f"  [Supervisor] → {quick_choice.value} にルーティングします")
+        return {"next_agent": quick_choice.value}
+
+    if user_message in routing_cache:
+        agent_name = routing_cache[user_message]
+        print(f"  [Supervisor] 前回の判定を再利用: {agent_name}")
+        print(f"  [Supervisor] → {agent_name} にルーティングします")
+        return {"next_agent": agent_name}
     
     messages = [
-        SystemMessage(content="あなたは質問を分析して適切な専門家に振り分けるスーパーバイザーです。"),
-        HumanMessage(content=routing_prompt)
+        SUPERVISOR_SYSTEM,
+        HumanMessage(content=user_message)
     ]
     
     # Structured Output を使用して、確実に構造化されたデータを取得
@@ -136,13 +202,14 @@ def supervisor(state: State) -> dict:
     try:
         # コールバックを無効にして警告を抑制（オプション）
         # config = {"callbacks": []}  # コールバックを無効にする場合
-        decision: RoutingDecision = structured_llm.invoke(messages)
+        decision: RoutingDecision = await structured_llm.ainvoke(messages)
         
         # デバッグ情報を表示
         print(f"  [Supervisor] 選択されたエージェント: {decision.agent_name.value}")
         print(f"  [Supervisor] 理由: {decision.reason}")
         
         agent_name = decision.agent_name.value
+        routing_cache[user_message] = agent_name
         
     except Exception as e:
         # エラーが発生した場合のフォールバック
@@ -158,16 +225,12 @@ def supervisor(state: State) -> dict:
 # 6. ルーティング関数（条件分岐）
 # -------------------------------------------------
 
-def route_to_agent(state: State) -> Literal["question_agent", "calculation_agent", "search_agent", "__end__"]:
-    """Supervisorが決定したエージェントにルーティングする"""
-    next_agent = state.get("next_agent", "question_agent")
-    
-    if len(state["messages"]) > 1:
-        last_msg = state["messages"][-1]
-        if isinstance(last_msg, AIMessage):
-            return "__end__"
-    
-    return next_agent  # type: ignore
+def route_to_agent(state: State) -> Literal["question_agent", "calculation_agent", "search_agent"]:
+    """Supervisorが決定したエージェントにルーティングする
+    route_to_agent が呼ばれるのは supervisor の直後だけ（エージェントからは END に直行）なので、
+    「回答済みなら終了」のような判定は不要で、next_agent をそのまま返すだけで済みます。
+    """
+    return state.get("next_agent") or "question_agent"  # type: ignore
 
 # -------------------------------------------------
 # 7. グラフ構築
@@ -188,7 +251,6 @@ builder.add_conditional_edges(
         "question_agent": "question_agent",
         "calculation_agent": "calculation_agent",
         "search_agent": "search_agent",
-        "__end__": END
     }
 )
 
@@ -223,27 +285,29 @@ async def main():
         }
     ]
     
-    for i, test_case in enumerate(test_cases, 1):
+    initial_states = [
+        {
+            "messages": [HumanMessage(content=test_case["query"])],
+            "next_agent": ""
+        }
+        for test_case in test_cases
+    ]
+
+    # 必要なのは最終回答だけなので、細かいイベントを全部流す astream_events ではなく
+    # ainvoke で最終状態だけを受け取ります
+    # 各ケースは互いに独立した会話なので、まとめて同時に実行します
+    # （途中経過のログは混ざりますが、結果はケース順に表示します）
+    final_states = await asyncio.gather(*(graph.ainvoke(s) for s in initial_states))
+
+    for test_case, final_state in zip(test_cases, final_states):
         print(f"\n{'='*60}")
         print(f"{test_case['name']}")
         print(f"{'='*60}")
         print(f"[User] {test_case['query']}\n")
-        
-        initial_state = {
-            "messages": [HumanMessage(content=test_case["query"])],
-            "next_agent": ""
-        }
-        
-        final_state = None
-        async for event in graph.astream_events(initial_state, version="v1"):
-            if event["event"] == "on_chain_end":
-                name = event.get("name", "")
-                if name in ["question_agent", "calculation_agent", "search_agent"]:
-                    output = event["data"]["output"]
-                    if "messages" in output and output["messages"]:
-                        last_msg = output["messages"][-1]
-                        if isinstance(last_msg, AIMessage):
-                            print(f"\n[Final Answer]\n{last_msg.content}")
+
+        last_msg = final_state["messages"][-1]
+        if isinstance(last_msg, AIMessage):
+            print(f"\n[Final Answer]\n{last_msg.content}")
         
         print("\n" + "-"*60)
 
@@ -11,29 +11,48 @@ Error Handling & Recovery（エラーハンドリングとリカバリー）
 5. エラーログの記録
 """
 import asyncio
+import logging
+import os
 import time
 import random
+import sys
+from pathlib import Path
 from typing import TypedDict, Annotated, List, Optional
 from dotenv import load_dotenv
 
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from tenacity import (
     retry,
     stop_after_attempt,
-    wait_exponential,
+    wait_random_exponential,
     retry_if_exception_type,
+    before_sleep_log,
     RetryError
 )
 
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.sqlite_cache import SQLiteCache
+from core.http_clients import get_http_client, get_async_http_client
+
 # -------------------------------------------------
 # 1. 環境設定
 # -------------------------------------------------
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o-mini")
+# tenacity のリトライ待機をログに残すためのロガー
+logger = logging.getLogger(__name__)
+
+llm = ChatOpenAI(
+    model="gpt-4o-mini",
+    cache=SQLiteCache(),
+    http_client=get_http_client(),
+    http_async_client=get_async_http_client(),
+)
 
 # -------------------------------------------------
 # 2. State 定義
@@ -56,17 +75,39 @@ def log_error(node_name: str, error: Exception, attempt: int = 1):
     print(f"  ⚠️  {error_msg}")
     return error_msg
 
+class FaultInjector:
+    """デモ用のエラー発生器
+    seed を固定すると毎回同じ順番でエラーやタイムアウトが起きるため、
+    実行時間の計測やプロファイリングの結果を実行ごとに比較できます。
+    seed=None の場合は実行ごとにランダムになります。
+    """
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+
+    def should_fail(self, rate: float) -> bool:
+        return self.rng.random() < rate
+
+    def uniform(self, a: float, b: float) -> float:
+        return self.rng.uniform(a, b)
+
+# config で指定されなかった場合に使うエラー発生器（ランダム）
+default_fault_injector = FaultInjector()
+
+def get_fault_injector(config: RunnableConfig) -> FaultInjector:
+    """config["configurable"]["fault_injector"] からエラー発生器を取得"""
+    return config.get("configurable", {}).get("fault_injector", default_fault_injector)
+
 # -------------------------------------------------
 # 4. ノード定義（エラーハンドリング付き）
 # -------------------------------------------------
 
-def unreliable_api_call(query: str) -> str:
+def unreliable_api_call(query: str, faults: FaultInjector) -> str:
     """
     不安定な外部API呼び出しをシミュレート
     50%の確率でエラーを発生させる（デモ用）
     """
     # ランダムにエラーを発生させる（デモ用）
-    if random.random() < 0.5:
+    if faults.should_fail(0.5):
         raise ConnectionError(f"API接続エラー: {query} へのリクエストが失敗しました")
     
     # 正常な場合
@@ -74,11 +115,12 @@ def unreliable_api_call(query: str) -> str:
 
 @retry(
     stop=stop_after_attempt(3),  # 最大3回までリトライ
-    wait=wait_exponential(multiplier=1, min=1, max=10),  # 指数バックオフ（1秒、2秒、4秒...）
+    wait=wait_random_exponential(multiplier=1, max=10),  # ジッター付き指数バックオフ（0〜1秒、0〜2秒、0〜4秒...の範囲でランダム）
     retry=retry_if_exception_type((ConnectionError, TimeoutError)),  # これらのエラーのみリトライ
+    before_sleep=before_sleep_log(logger, logging.WARNING),  # 待機前にリトライ回数をログに残す
     reraise=True  # 最終的に失敗した場合は例外を再発生
 )
-def api_node_with_retry(state: State) -> dict:
+def api_node_with_retry(state: State, config: RunnableConfig) -> dict:
     """リトライ機能付きのAPI呼び出しノード"""
     print("\n[API Node] 外部APIを呼び出し中...")
     
@@ -87,7 +129,7 @@ def api_node_with_retry(state: State) -> dict:
     
     try:
         # 不安定なAPI呼び出しをシミュレート
-        result = unreliable_api_call(query)
+        result = unreliable_api_call(query, get_fault_injector(config))
         print(f"  ✅ [API Node] 成功: {result}")
         return {
             "result": result,
@@ -138,12 +180,12 @@ def llm_node_with_error_handling(state: State) -> dict:
             "last_error": error_msg
         }
 
-def timeout_simulation_node(state: State) -> dict:
+def timeout_simulation_node(state: State, config: RunnableConfig) -> dict:
     """タイムアウトをシミュレートするノード"""
     print("\n[Timeout Node] 長時間処理をシミュレート中...")
     
     # ランダムに長時間処理をシミュレート（デモ用）
-    processing_time = random.uniform(0.5, 3.0)
+    processing_time = get_fault_injector(config).uniform(0.5, 3.0)
     
     if processing_time > 2.0:
         # タイムアウトとみなす
@@ -155,14 +197,15 @@ def timeout_simulation_node(state: State) -> dict:
 
 @retry(
     stop=stop_after_attempt(2),  # 最大2回までリトライ
-    wait=wait_exponential(multiplier=0.5, min=0.5, max=2),
+    wait=wait_random_exponential(multiplier=0.5, max=2),
     retry=retry_if_exception_type(TimeoutError),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
     reraise=True
 )
-def timeout_node_with_retry(state: State) -> dict:
+def timeout_node_with_retry(state: State, config: RunnableConfig) -> dict:
     """タイムアウトリトライ付きノード"""
     try:
-        return timeout_simulation_node(state)
+        return timeout_simulation_node(state, config)
     except TimeoutError as e:
         log_error("Timeout Node", e)
         raise  # tenacityにリトライを委ねる
@@ -207,14 +250,11 @@ def error_recovery_node(state: State) -> dict:
 
 def check_error_state(state: State) -> str:
     """エラー状態をチェックして次のノードを決定"""
-    error_count = state.get("error_count", 0)
-    result = state.get("result")
-    
     # エラーが発生している、または結果がない場合はリカバリーノードへ
-    if error_count > 0 or result is None:
+    # （error_count が 0 / None なら偽。エラーがあれば result を見ずに即決定）
+    if state.get("error_count") or state.get("result") is None:
         return "recovery"
-    else:
-        return "end"
+    return "end"
 
 # -------------------------------------------------
 # 6. グラフ構築
@@ -246,11 +286,43 @@ builder.add_edge("recovery", END)
 
 graph = builder.compile()
 
+# グラフ構造の描画はレイアウト計算が重いので、DEBUG_GRAPH=1 のときだけ1回だけ行います
+# （グラフは実行中に変わらないので、描画結果を使い回せます）
+GRAPH_ASCII = graph.get_graph().draw_ascii() if os.getenv("DEBUG_GRAPH") == "1" else None
+
 # -------------------------------------------------
 # 7. 実行
 # -------------------------------------------------
+async def run_case(test_case: dict, config: RunnableConfig) -> tuple[Optional[dict], Optional[str]]:
+    """1つのテストケースを実行し、(最終状態, エラーメッセージ) を返す"""
+    initial_state = {
+        "messages": [HumanMessage(content=test_case["query"])],
+        "query": test_case["query"],
+        "result": None,
+        "error_count": 0,
+        "last_error": None,
+        "retry_count": 0
+    }
+    try:
+        return await graph.ainvoke(initial_state, config), None
+    except RetryError as e:
+        return None, f"最大リトライ回数に達しました: {e}"
+    except Exception as e:
+        return None, f"予期しないエラー: {type(e).__name__}: {e}"
+
 async def main():
     print("--- Error Handling & Recovery Bot 開始 ---\n")
+
+    # FAULT_SEED を指定すると、エラーの発生パターンが毎回同じになります
+    # 例: FAULT_SEED=42 python error_handling_bot.py
+    # 整数として読めない値が指定された場合は、警告を出してランダムなパターンで実行します
+    seed_env = os.getenv("FAULT_SEED")
+    seed: Optional[int] = None
+    if seed_env:
+        try:
+            seed = int(seed_env)
+        except ValueError:
+            print(f"⚠️  FAULT_SEED には整数を指定してください（指定値: {seed_env!r}）。シードを固定せずに実行します\n")
     
     test_cases = [
         {
@@ -269,57 +341,46 @@ async def main():
             "description": "タイムアウトが発生する場合の動作を確認"
         }
     ]
-    
-    for i, test_case in enumerate(test_cases, 1):
+
+    # 各ケースは独立しているので、まとめて同時に実行します
+    # （全体の待ち時間は「全ケースの合計」ではなく「最も遅いケース1つ分」になる）
+    # 同時に実行してもエラーの発生パターンが変わらないよう、エラー発生器はケースごとに用意します
+    configs = [
+        {"configurable": {"fault_injector": FaultInjector(seed + i if seed is not None else None)}}
+        for i in range(len(test_cases))
+    ]
+    print("※ 各ノードのログは、複数のケースが同時に実行されるため混ざって表示されます")
+    outcomes = await asyncio.gather(*(
+        run_case(test_case, config) for test_case, config in zip(test_cases, configs)
+    ))
+
+    # 結果はケースの順番どおりに表示
+    for test_case, (final_state, error) in zip(test_cases, outcomes):
         print(f"\n{'='*60}")
         print(f"{test_case['name']}")
         print(f"説明: {test_case['description']}")
-        print(f"{'='*60}\n")
-        
-        initial_state = {
-            "messages": [HumanMessage(content=test_case["query"])],
-            "query": test_case["query"],
-            "result": None,
-            "error_count": 0,
-            "last_error": None,
-            "retry_count": 0
-        }
-        
-        try:
-            # グラフを実行
-            final_state = None
-            async for event in graph.astream_events(initial_state, version="v1"):
-                if event["event"] == "on_chain_end":
-                    name = event.get("name", "")
-                    if name in ["llm_call", "recovery"]:
-                        output = event["data"]["output"]
-                        if "messages" in output and output["messages"]:
-                            last_msg = output["messages"][-1]
-                            if isinstance(last_msg, AIMessage):
-                                print(f"\n[Final Message]\n{last_msg.content}")
-            
+        print(f"{'='*60}")
+
+        if error:
+            print(f"\n  ❌ {error}")
+        else:
+            # ユーザーの入力以降に追加された AI のメッセージ（LLM の回答・リカバリーメッセージ）を表示
+            for msg in final_state["messages"][1:]:
+                if isinstance(msg, AIMessage):
+                    print(f"\n[Final Message]\n{msg.content}")
+
             print(f"\n[最終状態]")
-            print(f"  エラー回数: {initial_state.get('error_count', 0)}")
-            print(f"  リトライ回数: {initial_state.get('retry_count', 0)}")
-            if initial_state.get("last_error"):
-                print(f"  最後のエラー: {initial_state['last_error']}")
-        
-        except RetryError as e:
-            print(f"\n  ❌ 最大リトライ回数に達しました: {e}")
-        except Exception as e:
-            print(f"\n  ❌ 予期しないエラー: {type(e).__name__}: {e}")
-        finally:
-            # エラーが発生してもグラフ構造を表示
-            print(f"\n[グラフ構造]")
-            graph_ascii = graph.get_graph().print_ascii()
-            print(graph_ascii)
-        
+            print(f"  エラー回数: {final_state.get('error_count', 0)}")
+            print(f"  リトライ回数: {final_state.get('retry_count', 0)}")
+            if final_state.get("last_error"):
+                print(f"  最後のエラー: {final_state['last_error']}")
+
         print("\n" + "-"*60)
-        
-        # テストケース間で少し待機（APIレート制限対策）
-        if i < len(test_cases):
-            await asyncio.sleep(1)
+
+    # グラフ構造を表示（DEBUG_GRAPH=1 のときのみ）
+    if GRAPH_ASCII:
+        print(f"\n[グラフ構造]")
+        print(GRAPH_ASCII)
 
 if __name__ == "__main__":
     asyncio.run(main())
-
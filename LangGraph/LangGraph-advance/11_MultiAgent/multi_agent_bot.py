@@ -11,21 +11,73 @@ Multi-Agent System（マルチエージェントシステム）
 5. コーディネーターによる全体制御
 """
 import asyncio
+import logging
 import operator
+import os
+import sys
+from pathlib import Path
 from typing import TypedDict, Annotated, List, Optional
 from dotenv import load_dotenv
 
 from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableConfig
+from openai import APIConnectionError, InternalServerError, RateLimitError
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
+from tenacity import (
+    retry,
+    stop_after_attempt,
+    wait_random_exponential,
+    retry_if_exception_type,
+    before_sleep_log,
+)
+
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.http_clients import get_http_client, get_async_http_client
+from core.sqlite_cache import SQLiteCache
 
 # -------------------------------------------------
 # 1. 環境設定
 # -------------------------------------------------
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o-mini")
+# 同じトピックを再実行したときは、リサーチ結果などをキャッシュから返します
+# （各エージェントのプロンプトは固定の指示文にトピックを差し込むだけなので、意味的類似ではなく完全一致で判定します）
+# 再試行は下の ainvoke_limited で tenacity に任せるので、OpenAI クライアント自体の再試行は無効にします
+llm = ChatOpenAI(
+    model="gpt-4o-mini",
+    cache=SQLiteCache(),
+    max_retries=0,
+    http_client=get_http_client(),
+    http_async_client=get_async_http_client(),
+)
+
+# tenacity のリトライ待機をログに残すためのロガー
+logger = logging.getLogger(__name__)
+
+# 複数トピックを同時に実行すると、リサーチャーだけで「トピック数 × 3」件のリクエストが一斉に飛びます。
+# OpenAI の同時実行数の上限を超えないよう、同時に送る LLM リクエストの数をセマフォで制限します
+# 別のセマフォを使いたい場合は config={"configurable": {"llm_semaphore": ...}} で渡せます
+# （Python 3.10 以降のセマフォは、作成時ではなく最初に使われたときのイベントループに結び付くので、モジュールで作っても問題ありません）
+MAX_CONCURRENT_LLM_CALLS = 8
+llm_semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+
+# レート制限（429）・一時的なサーバーエラー（5xx）・接続エラーのときは、ジッター付き指数バックオフで再試行します
+# 待機中はセマフォを手放すので、待っている間も他のリクエストは進みます
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type((RateLimitError, InternalServerError, APIConnectionError)),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
+async def ainvoke_limited(runnable, messages, config: RunnableConfig):
+    """同時実行数の上限を守りながら LLM を呼び出す"""
+    async with config.get("configurable", {}).get("llm_semaphore", llm_semaphore):
+        return await runnable.ainvoke(messages)
 
 # -------------------------------------------------
 # 2. State 定義
@@ -42,58 +94,66 @@ class State(TypedDict):
 # 3. 専門エージェントの定義
 # -------------------------------------------------
 
-def researcher_agent_1(state: State) -> dict:
+# システムプロンプトは毎回同じなので、モジュール読み込み時に1回だけ作って使い回します
+TECH_RESEARCHER_SYSTEM = SystemMessage(content="あなたは技術情報を専門にリサーチするエージェントです。技術的な詳細、仕様、実装方法などを調べてください。")
+MARKET_RESEARCHER_SYSTEM = SystemMessage(content="あなたは市場動向やトレンドを専門にリサーチするエージェントです。業界の動向、市場規模、将来予測などを調べてください。")
+USER_RESEARCHER_SYSTEM = SystemMessage(content="あなたはユーザー視点や実用例を専門にリサーチするエージェントです。実際の使用例、ユーザーの声、成功事例などを調べてください。")
+WRITER_SYSTEM = SystemMessage(content="あなたは技術記事を書く専門ライターです。リサーチ結果を元に、分かりやすく読みやすい記事を書いてください。")
+REVIEWER_SYSTEM = SystemMessage(content="あなたは技術記事のレビュアーです。記事の品質、正確性、読みやすさを評価し、改善点を指摘してください。")
+EDITOR_SYSTEM = SystemMessage(content="あなたは技術記事のエディターです。レビューフィードバックを踏まえて、記事を最終化してください。")
+
+async def researcher_agent_1(state: State, config: RunnableConfig) -> dict:
     """リサーチエージェント1: 技術的な情報を収集"""
     print("\n[Researcher 1] 技術情報をリサーチ中...")
     
     topic = state.get("topic", "")
     
     messages = [
-        SystemMessage(content="あなたは技術情報を専門にリサーチするエージェントです。技術的な詳細、仕様、実装方法などを調べてください。"),
+        TECH_RESEARCHER_SYSTEM,
         HumanMessage(content=f"「{topic}」について、技術的な観点から重要な情報を3つ挙げてください。")
     ]
     
-    response = llm.invoke(messages)
+    response = await ainvoke_limited(llm, messages, config)
     research_result = f"[技術情報] {response.content}"
     
     print(f"  ✅ [Researcher 1] 完了")
     return {"research_results": [research_result]}
 
-def researcher_agent_2(state: State) -> dict:
+async def researcher_agent_2(state: State, config: RunnableConfig) -> dict:
     """リサーチエージェント2: 市場動向やトレンドを収集"""
     print("\n[Researcher 2] 市場動向をリサーチ中...")
     
     topic = state.get("topic", "")
     
     messages = [
-        SystemMessage(content="あなたは市場動向やトレンドを専門にリサーチするエージェントです。業界の動向、市場規模、将来予測などを調べてください。"),
+        MARKET_RESEARCHER_SYSTEM,
         HumanMessage(content=f"「{topic}」について、市場動向やトレンドの観点から重要な情報を3つ挙げてください。")
     ]
     
-    response = llm.invoke(messages)
+    response = await ainvoke_limited(llm, messages, config)
     research_result = f"[市場動向] {response.content}"
     
     print(f"  ✅ [Researcher 2] 完了")
     return {"research_results": [research_result]}
 
-def researcher_agent_3(state: State) -> dict:
+async def researcher_agent_3(state: State, config: RunnableConfig) -> dict:
     """リサーチエージェント3: ユーザー視点や事例を収集"""
     print("\n[Researcher 3] ユーザー視点をリサーチ中...")
     
     topic = state.get("topic", "")
     
     messages = [
-        SystemMessage(content="あなたはユーザー視点や実用例を専門にリサーチするエージェントです。実際の使用例、ユーザーの声、成功事例などを調べてください。"),
+        USER_RESEARCHER_SYSTEM,
         HumanMessage(content=f"「{topic}」について、ユーザー視点や実用例の観点から重要な情報を3つ挙げてください。")
     ]
     
-    response = llm.invoke(messages)
+    response = await ainvoke_limited(llm, messages, config)
     research_result = f"[ユーザー視点] {response.content}"
     
     print(f"  ✅ [Researcher 3] 完了")
     return {"research_results": [research_result]}
 
-def writer_agent(state: State) -> dict:
+async def writer_agent(state: State, config: RunnableConfig) -> dict:
     """ライターエージェント: リサーチ結果を元に記事を執筆"""
     print("\n[Writer] 記事を執筆中...")
     
@@ -104,7 +164,7 @@ def writer_agent(state: State) -> dict:
     research_summary = "\n\n".join(research_results)
     
     messages = [
-        SystemMessage(content="あなたは技術記事を書く専門ライターです。リサーチ結果を元に、分かりやすく読みやすい記事を書いてください。"),
+        WRITER_SYSTEM,
         HumanMessage(content=f"""
 以下のリサーチ結果を元に、「{topic}」についての技術記事を執筆してください。
 
@@ -119,13 +179,13 @@ def writer_agent(state: State) -> dict:
 """)
     ]
     
-    response = llm.invoke(messages)
+    response = await ainvoke_limited(llm, messages, config)
     draft = response.content
     
     print(f"  ✅ [Writer] 下書き完成（{len(draft)}文字）")
     return {"draft": draft}
 
-def reviewer_agent(state: State) -> dict:
+async def reviewer_agent(state: State, config: RunnableConfig) -> dict:
     """レビュアーエージェント: 記事をレビューしてフィードバックを提供"""
     print("\n[Reviewer] 記事をレビュー中...")
     
@@ -136,7 +196,7 @@ def reviewer_agent(state: State) -> dict:
         return {"review_feedback": "下書きが存在しません。"}
     
     messages = [
-        SystemMessage(content="あなたは技術記事のレビュアーです。記事の品質、正確性、読みやすさを評価し、改善点を指摘してください。"),
+        REVIEWER_SYSTEM,
         HumanMessage(content=f"""
 以下の記事をレビューしてください。
 
@@ -155,13 +215,13 @@ def reviewer_agent(state: State) -> dict:
 """)
     ]
     
-    response = llm.invoke(messages)
+    response = await ainvoke_limited(llm, messages, config)
     feedback = response.content
     
     print(f"  ✅ [Reviewer] レビュー完了")
     return {"review_feedback": feedback}
 
-def editor_agent(state: State) -> dict:
+async def editor_agent(state: State, config: RunnableConfig) -> dict:
     """エディターエージェント: レビューフィードバックを元に記事を最終化"""
     print("\n[Editor] 記事を最終化中...")
     
@@ -173,7 +233,7 @@ def editor_agent(state: State) -> dict:
         return {"final_article": "下書きが存在しません。"}
     
     messages = [
-        SystemMessage(content="あなたは技術記事のエディターです。レビューフィードバックを踏まえて、記事を最終化してください。"),
+        EDITOR_SYSTEM,
         HumanMessage(content=f"""
 以下の下書きとレビューフィードバックを元に、記事を最終化してください。
 
@@ -189,7 +249,7 @@ def editor_agent(state: State) -> dict:
 """)
     ]
     
-    response = llm.invoke(messages)
+    response = await ainvoke_limited(llm, messages, config)
     final_article = response.content
     
     print(f"  ✅ [Editor] 最終版完成（{len(final_article)}文字）")
@@ -226,11 +286,83 @@ builder.add_edge("editor", END)
 
 graph = builder.compile()
 
+# -------------------------------------------------
+# 4-2. 別パターン: 執筆・レビュー・編集を1回の LLM 呼び出しにまとめる
+# -------------------------------------------------
+# writer → reviewer → editor は LLM を3回順番に呼ぶため、待ち時間も3回分かかります。
+# 1回の呼び出しで「下書き → セルフレビュー → 最終版」までまとめて出力させれば、往復は1回で済みます。
+# （役割ごとにエージェントを分ける本来の構成に比べると、レビューの客観性は下がります）
+
+class ArticleResult(BaseModel):
+    """執筆・レビュー・編集をまとめて行った結果"""
+    draft: str = Field(description="リサーチ結果を元に書いた下書き（800文字程度）")
+    feedback: str = Field(description="下書きに対するレビュー（技術的な正確性、読みやすさと構成、具体例の適切性、改善すべき点）")
+    final_article: str = Field(description="レビューを反映して改善した最終版の記事")
+
+COMPOSER_SYSTEM = SystemMessage(content="""あなたは技術記事のライター・レビュアー・エディターを1人で兼ねる専門家です。
+次の3段階を順に行い、すべての結果を返してください。
+1. リサーチ結果を元に、分かりやすく読みやすい下書きを書く
+2. 下書きの品質、正確性、読みやすさを評価し、改善点を指摘する
+3. 指摘した改善点を反映して、記事を最終化する""")
+
+composer_llm = llm.with_structured_output(ArticleResult)
+
+async def composer_agent(state: State, config: RunnableConfig) -> dict:
+    """コンポーザーエージェント: 執筆・レビュー・編集を1回の LLM 呼び出しで行う"""
+    print("\n[Composer] 記事を執筆・レビュー・最終化中...")
+
+    topic = state.get("topic", "")
+    research_summary = "\n\n".join(state.get("research_results", []))
+
+    messages = [
+        COMPOSER_SYSTEM,
+        HumanMessage(content=f"""
+以下のリサーチ結果を元に、「{topic}」についての技術記事を作成してください。
+
+リサーチ結果:
+{research_summary}
+
+記事の要件:
+- 800文字程度
+- 技術的な正確性を保つ
+- 読みやすく分かりやすい構成
+- 具体例を含める
+""")
+    ]
+
+    result: ArticleResult = await ainvoke_limited(composer_llm, messages, config)
+
+    print(f"  ✅ [Composer] 最終版完成（{len(result.final_article)}文字）")
+    return {
+        "draft": result.draft,
+        "review_feedback": result.feedback,
+        "final_article": result.final_article,
+    }
+
+compose_builder = StateGraph(State)
+compose_builder.add_node("researcher_1", researcher_agent_1)
+compose_builder.add_node("researcher_2", researcher_agent_2)
+compose_builder.add_node("researcher_3", researcher_agent_3)
+compose_builder.add_node("composer", composer_agent)
+
+compose_builder.add_edge(START, "researcher_1")
+compose_builder.add_edge(START, "researcher_2")
+compose_builder.add_edge(START, "researcher_3")
+compose_builder.add_edge("researcher_1", "composer")
+compose_builder.add_edge("researcher_2", "composer")
+compose_builder.add_edge("researcher_3", "composer")
+compose_builder.add_edge("composer", END)
+
+compose_graph = compose_builder.compile()
+
 # -------------------------------------------------
 # 5. 実行
 # -------------------------------------------------
 async def main():
     print("--- Multi-Agent System Bot 開始 ---\n")
+
+    # ARTICLE_MODE=compose のときは、執筆・レビュー・編集を1回にまとめた別パターンで実行
+    app = compose_graph if os.getenv("ARTICLE_MODE") == "compose" else graph
     
     test_topics = [
         "LangGraphの特徴と使い方",
@@ -238,12 +370,8 @@ async def main():
         "AIエージェントの実装パターン"
     ]
     
-    for i, topic in enumerate(test_topics, 1):
-        print(f"\n{'='*60}")
-        print(f"ケース{i}: {topic}")
-        print(f"{'='*60}\n")
-        
-        initial_state = {
+    initial_states = [
+        {
             "messages": [HumanMessage(content=f"「{topic}」についての記事を作成してください")],
             "topic": topic,
             "research_results": [],
@@ -251,37 +379,38 @@ async def main():
             "review_feedback": None,
             "final_article": None
         }
-        
-        # グラフを実行
-        final_state = None
-        async for event in graph.astream_events(initial_state, version="v1"):
-            if event["event"] == "on_chain_end":
-                name = event.get("name", "")
-                if name == "editor":
-                    output = event["data"]["output"]
-                    if "final_article" in output:
-                        print(f"\n{'='*60}")
-                        print("【最終記事】")
-                        print(f"{'='*60}")
-                        print(output["final_article"])
+        for topic in test_topics
+    ]
+
+    # グラフを実行
+    # 必要なのは最終記事とリサーチ結果だけなので、astream_events で細かいイベントを全部受け取らず、
+    # ainvoke で最終状態だけを受け取ります
+    # トピックごとの記事作成は互いに独立しているので、まとめて同時に実行します
+    final_states = await asyncio.gather(*(app.ainvoke(s) for s in initial_states))
+
+    for i, (topic, final_state) in enumerate(zip(test_topics, final_states), 1):
+        print(f"\n{'='*60}")
+        print(f"ケース{i}: {topic}")
+        print(f"{'='*60}\n")
+
+        print(f"\n{'='*60}")
+        print("【最終記事】")
+        print(f"{'='*60}")
+        print(final_state["final_article"])
         
         print(f"\n{'='*60}")
         print("【リサーチ結果の要約】")
         print(f"{'='*60}")
-        for j, result in enumerate(initial_state.get("research_results", []), 1):
+        for j, result in enumerate(final_state.get("research_results", []), 1):
             print(f"\n{j}. {result[:100]}...")  # 最初の100文字だけ表示
         
         print("\n" + "-"*60)
-        
-        # テストケース間で少し待機（APIレート制限対策）
-        if i < len(test_topics):
-            await asyncio.sleep(2)
     
     # グラフ構造を表示
     print(f"\n{'='*60}")
     print("【グラフ構造】")
     print(f"{'='*60}")
-    graph_ascii = graph.get_graph().print_ascii()
+    graph_ascii = app.get_graph().print_ascii()
     print(graph_ascii)
 
 if __name__ == "__main__":
@@ -1,3 +1,5 @@
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 from typing import TypedDict
 from typing import Annotated
@@ -5,11 +7,16 @@ from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.sqlite_cache import SQLiteCache
+
 #.envファイルから環境変数を読み込む
 load_dotenv()
 
 #llmモデルの設定
-llm = ChatOpenAI(model="gpt-4o-mini")
+# 同じ入力で実行し直したときは、前回のレスポンスを SQLite のキャッシュから返します
+llm = ChatOpenAI(model="gpt-4o-mini", cache=SQLiteCache())
 
 #Stateの定義
 class State(TypedDict):
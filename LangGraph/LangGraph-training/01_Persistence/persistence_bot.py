@@ -1,9 +1,18 @@
+import os
+import sqlite3
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 from typing import TypedDict, Annotated
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.messages import HumanMessage, RemoveMessage, SystemMessage
+
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.sqlite_cache import SQLiteCache
 
 # 環境変数の読み込み
 load_dotenv()
@@ -11,22 +20,76 @@ load_dotenv()
 # 1. Stateの定義
 class State(TypedDict):
     messages: Annotated[list, add_messages]
+    # 古いメッセージを置き換えた要約（履歴が長くなるまでは空）
+    summary: str
 
 # 2. ノードの定義
-llm = ChatOpenAI(model="gpt-4o-mini")
+# 同じ入力で実行し直したときは、前回のレスポンスを SQLite のキャッシュから返します
+llm = ChatOpenAI(model="gpt-4o-mini", cache=SQLiteCache())
+
+# 履歴の長さの上限
+# 会話が続くと毎回の LLM 呼び出しに渡す履歴が伸び続け、料金も応答までの時間も増えていくので、
+# MAX_MESSAGES を超えたら直近 KEEP_MESSAGES 件だけを残し、それより古いメッセージは要約に置き換えます
+MAX_MESSAGES = 12
+KEEP_MESSAGES = 6
 
 def chatbot(state: State):
-    return {"messages": [llm.invoke(state["messages"])]}
+    messages = state["messages"]
+    summary = state.get("summary", "")
+    if summary:
+        # 要約は常に先頭に置く（毎回同じ書き出しになるので、OpenAI のプロンプトキャッシュにも当たりやすい）
+        messages = [SystemMessage(content=f"これまでの会話の要約: {summary}")] + messages
+    return {"messages": [llm.invoke(messages)]}
+
+def summarize(state: State):
+    """古いメッセージを要約に置き換える"""
+    messages = state["messages"]
+    cut = len(messages) - KEEP_MESSAGES
+    # 残す部分が AI の返答から始まらないよう、ユーザーのメッセージの位置まで戻す
+    while cut > 0 and not isinstance(messages[cut], HumanMessage):
+        cut -= 1
+    old_messages = messages[:cut]
+    summary = state.get("summary", "")
+    if summary:
+        instruction = f"これまでの会話の要約: {summary}\n\n上記の要約に、ここまでの会話の内容を加えて200文字程度で要約し直してください。"
+    else:
+        instruction = "ここまでの会話を200文字程度で要約してください。"
+    instruction += "ユーザーの名前や好みなど、この後の会話で必要になりそうな情報は必ず残してください。"
+    response = llm.invoke(old_messages + [HumanMessage(content=instruction)])
+    # RemoveMessage を返すと、add_messages がその ID のメッセージを履歴から削除します
+    return {
+        "summary": response.content,
+        "messages": [RemoveMessage(id=m.id) for m in old_messages],
+    }
+
+def should_summarize(state: State):
+    """履歴が上限を超えていれば、chatbot の前に summarize を実行する"""
+    if len(state["messages"]) > MAX_MESSAGES:
+        return "summarize"
+    return "chatbot"
 
 # 3. グラフの構築
 builder = StateGraph(State)
+builder.add_node("summarize", summarize)
 builder.add_node("chatbot", chatbot)
-builder.add_edge(START, "chatbot")
+builder.add_conditional_edges(START, should_summarize, ["summarize", "chatbot"])
+builder.add_edge("summarize", "chatbot")
 builder.add_edge("chatbot", END)
 
 # 4. チェックポインター（メモリ）の準備
 # これが「記憶」を司るデータベースの役割を果たします（今回はオンメモリ）
-memory = MemorySaver()
+checkpoint_db = os.getenv("CHECKPOINT_DB")
+if checkpoint_db:
+    # 環境変数 CHECKPOINT_DB にファイルパスを指定すると、チェックポイントを SQLite ファイルに保存します
+    # （スクリプトを実行し直しても、同じ thread_id の記憶が残ります）
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    conn = sqlite3.connect(checkpoint_db, check_same_thread=False)
+    # SqliteSaver はテーブル作成時に WAL モードに切り替えるので、同期は NORMAL で十分です
+    # （ステップごとのコミットで fsync を待たずに済みます）
+    conn.execute("PRAGMA synchronous=NORMAL")
+    memory = SqliteSaver(conn)
+else:
+    memory = MemorySaver()
 
 # 5. コンパイル（checkpointerを指定するのが重要！）
 graph = builder.compile(checkpointer=memory)
@@ -35,23 +98,31 @@ graph = builder.compile(checkpointer=memory)
 # thread_id が同じなら、記憶が引き継がれます
 config = {"configurable": {"thread_id": "user-1"}}
 
+# stream_mode="messages" では、LLM の返答がトークン単位の (チャンク, メタデータ) として流れてきます
+# （ノードの出力をまとめて受け取る代わりに、届いたそばから表示する。summarize ノードの要約は表示しない）
 print("--- 1回目の会話 (user-1) ---")
 input_message = {"messages": [("user", "私の名前は田中です。")]}
-for event in graph.stream(input_message, config):
-    for value in event.values():
-        print("Assistant:", value["messages"][-1].content)
+print("Assistant: ", end="")
+for chunk, metadata in graph.stream(input_message, config, stream_mode="messages"):
+    if metadata["langgraph_node"] == "chatbot":
+        print(chunk.content, end="", flush=True)
+print()
 
 print("\n--- 2回目の会話 (user-1) ---")
 # 前回の会話（名前は田中）を覚えているか確認
 input_message = {"messages": [("user", "私の名前を覚えていますか？")]}
-for event in graph.stream(input_message, config):
-    for value in event.values():
-        print("Assistant:", value["messages"][-1].content)
+print("Assistant: ", end="")
+for chunk, metadata in graph.stream(input_message, config, stream_mode="messages"):
+    if metadata["langgraph_node"] == "chatbot":
+        print(chunk.content, end="", flush=True)
+print()
 
 print("\n--- 別のユーザーの会話 (user-2) ---")
 # thread_id を変えると、記憶は共有されない
 config_2 = {"configurable": {"thread_id": "user-2"}}
 input_message = {"messages": [("user", "私の名前を覚えていますか？")]}
-for event in graph.stream(input_message, config_2):
-    for value in event.values():
-        print("Assistant:", value["messages"][-1].content)
+print("Assistant: ", end="")
+for chunk, metadata in graph.stream(input_message, config_2, stream_mode="messages"):
+    if metadata["langgraph_node"] == "chatbot":
+        print(chunk.content, end="", flush=True)
+print()
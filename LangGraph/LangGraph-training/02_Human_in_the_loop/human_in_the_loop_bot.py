@@ -1,3 +1,7 @@
+import os
+import sqlite3
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 from typing import TypedDict, Annotated
 from langchain_openai import ChatOpenAI
@@ -6,6 +10,10 @@ from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.messages import HumanMessage, AIMessage
 
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.sqlite_cache import SQLiteCache
+
 # 環境変数の読み込み
 load_dotenv()
 
@@ -14,7 +22,8 @@ class State(TypedDict):
     messages: Annotated[list, add_messages]
 
 # 2. ノードの定義
-llm = ChatOpenAI(model="gpt-4o-mini")
+# 同じ入力で実行し直したときは、前回のレスポンスを SQLite のキャッシュから返します
+llm = ChatOpenAI(model="gpt-4o-mini", cache=SQLiteCache())
 
 def chatbot(state: State):
     """ユーザーの要望に基づいてツイート案を作成する"""
@@ -40,7 +49,18 @@ builder.add_edge("chatbot", "publisher")
 builder.add_edge("publisher", END)
 
 # 4. チェックポインター（メモリ）の準備
-memory = MemorySaver()
+checkpoint_db = os.getenv("CHECKPOINT_DB")
+if checkpoint_db:
+    # 環境変数 CHECKPOINT_DB にファイルパスを指定すると、チェックポイントを SQLite ファイルに保存します
+    # （スクリプトを実行し直しても、同じ thread_id の記憶が残ります）
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    conn = sqlite3.connect(checkpoint_db, check_same_thread=False)
+    # SqliteSaver はテーブル作成時に WAL モードに切り替えるので、同期は NORMAL で十分です
+    # （ステップごとのコミットで fsync を待たずに済みます）
+    conn.execute("PRAGMA synchronous=NORMAL")
+    memory = SqliteSaver(conn)
+else:
+    memory = MemorySaver()
 
 # 5. コンパイル（★ここで interrupt_before を指定！）
 # "publisher" ノードを実行する「直前」で一時停止します
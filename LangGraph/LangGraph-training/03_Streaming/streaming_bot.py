@@ -16,8 +16,11 @@ class State(TypedDict):
 # 2. ノードの定義
 llm = ChatOpenAI(model="gpt-4o-mini", streaming=True) # streaming=True は明示しなくても動くことが多いですが、念のため
 
-def chatbot(state: State):
-    return {"messages": [llm.invoke(state["messages"])]}
+# ノードも async にして、生成を待つ間イベントループを止めないようにする
+# （streaming=True なので、ainvoke は内部でトークンを1つずつ受け取り、最後に1つのメッセージにまとめて返す。
+#  受け取った各トークンは on_chat_model_stream イベントとして main() に流れる）
+async def chatbot(state: State):
+    return {"messages": [await llm.ainvoke(state["messages"])]}
 
 # 3. グラフの構築
 builder = StateGraph(State)
@@ -1,14 +1,22 @@
+import asyncio
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 from typing import TypedDict, Annotated, List
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, BaseMessage
+
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.sqlite_cache import SQLiteCache
 
 # 環境変数の読み込み
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o-mini")
+# 同じ入力で実行し直したときは、前回のレスポンスを SQLite のキャッシュから返します
+llm = ChatOpenAI(model="gpt-4o-mini", cache=SQLiteCache())
 
 # ==========================================
 # 1. 子グラフ（リサーチチーム）の定義
@@ -21,12 +29,12 @@ class ResearchState(TypedDict):
     # 成果物（調査結果）
     research_summary: str
 
-def researcher(state: ResearchState):
+async def researcher(state: ResearchState):
     """調査を行うノード"""
     print("  [子] リサーチャー: 調査中...")
     query = state["messages"][-1].content
     # 実際は検索ツールなどを使うが、今回はLLMでシミュレーション
-    response = llm.invoke([
+    response = await llm.ainvoke([
         HumanMessage(content=f"「{query}」について、重要な事実を3つ箇条書きで挙げてください。")
     ])
     return {"messages": [response], "research_summary": response.content}
@@ -66,17 +74,18 @@ def topic_receiver(state: MainState):
     # ここでは特に何もしない（次のノードへメッセージを渡すだけ）
     return {}
 
-def writer(state: MainState):
+async def writer(state: MainState):
     """リサーチ結果を元に記事を書くノード"""
     print("[親] ライター: リサーチ結果が届いたな。記事を書こう。")
     
     # 直前のメッセージ（子グラフの最後の出力）を取得
     research_result = state["messages"][-1].content
     
-    response = llm.invoke([
+    response = await llm.ainvoke([
         HumanMessage(content=f"以下の調査結果を元に、短いブログ記事を書いてください。\n\n{research_result}")
     ])
-    print(f"\n[親] ライター: 完成！\n\n{response.content}")
+    # 記事の本文は、生成されたそばから run() で表示している
+    print("\n[親] ライター: 完成！")
     return {"messages": [response], "final_article": response.content}
 
 # 親グラフの構築
@@ -100,6 +109,26 @@ main_graph = main_builder.compile()
 # 3. 実行
 # ==========================================
 
+# LLM の出力をトークン単位で表示するノード（子グラフの中のノードも含む）
+STREAMED_NODES = {"researcher", "writer"}
+
+async def run(user_input: str):
+    """親グラフを実行し、LLM の出力を生成されたそばから表示する"""
+    # subgraphs=True を付けると、子グラフ（research_team）の中で呼ばれた LLM のトークンも
+    # (名前空間, (チャンク, メタデータ)) の形で親グラフの呼び出し元まで流れてくる
+    async for namespace, (chunk, metadata) in main_graph.astream(
+        {"messages": [HumanMessage(content=user_input)]},
+        stream_mode="messages",
+        subgraphs=True,
+    ):
+        # 名前空間（親か子か）に関係なく、ノード名だけで絞り込む
+        # （reviewer が返す固定のメッセージは表示しない）
+        if metadata.get("langgraph_node") in STREAMED_NODES:
+            print(chunk.content, end="", flush=True)
+            # 1回分の出力の最後で改行する（キャッシュにヒットした場合はチャンクに分かれず1回で届く）
+            if not isinstance(chunk, AIMessageChunk) or chunk.chunk_position == "last":
+                print()
+
 if __name__ == "__main__":
     print("--- アプリケーション開始 ---")
     
@@ -108,7 +137,7 @@ if __name__ == "__main__":
     
     # 親グラフを実行
     # 子グラフの実行は内部で自動的に行われる
-    main_graph.invoke({"messages": [HumanMessage(content=user_input)]})
+    asyncio.run(run(user_input))
     
     print("\n--- アプリケーション終了 ---")
     #print(main_graph.get_graph().print_ascii())
@@ -1,14 +1,37 @@
+import operator
+import os
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 from typing import TypedDict, Annotated, List
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langgraph.types import Send
+from pydantic import BaseModel, Field
+
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.sqlite_cache import SQLiteCache
 
 # 環境変数の読み込み
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-4o-mini")
+llm = ChatOpenAI(model="gpt-4o-mini", cache=SQLiteCache())
+
+# 批評用のプロンプト（ループのたびに組み立て直さないよう、テンプレートとして1回だけ作成）
+REFLECT_PROMPT = ChatPromptTemplate.from_messages([
+    ("human", """
+以下の文章を読んで、改善点を具体的に指摘してください。
+特に「論理性」「具体性」「表現の豊かさ」の観点からアドバイスしてください。
+
+対象の文章:
+{target_text}
+"""),
+])
+reflect_chain = REFLECT_PROMPT | llm
 
 # 1. Stateの定義
 class State(TypedDict):
@@ -18,6 +41,13 @@ class State(TypedDict):
 
 # 2. ノードの定義
 
+def trim_history(messages: list) -> list:
+    """修正に必要なメッセージだけを残す（最初の指示 + 直前の文章 + 直前の批評）
+    ループのたびに過去の全履歴を送ると、プロンプトのトークン数が回数に応じて増えていくため、
+    送る範囲を固定してループ1回あたりのコストを一定に保ちます。
+    """
+    return [messages[0]] + messages[-2:]
+
 def generator(state: State):
     """文章を生成（または修正）するノード"""
     messages = state["messages"]
@@ -31,7 +61,7 @@ def generator(state: State):
         print(f"\n[Generator] 修正中... (回数: {loop_count})")
         # 2回目以降は、直前の「批評」を踏まえて修正する
         # 直前のメッセージは Reflector からの批評になっているはず
-        instructions = messages + [HumanMessage(content="上記の批評を踏まえて、文章をより良く修正してください。")]
+        instructions = trim_history(messages) + [HumanMessage(content="上記の批評を踏まえて、文章をより良く修正してください。")]
         response = llm.invoke(instructions)
         
     return {"messages": [response], "loop_count": loop_count + 1}
@@ -43,15 +73,8 @@ def reflector(state: State):
     # 直前のメッセージ（Generatorの出力）を取得
     target_text = state["messages"][-1].content
     
-    # 批評を行うプロンプト
-    prompt = f"""
-    以下の文章を読んで、改善点を具体的に指摘してください。
-    特に「論理性」「具体性」「表現の豊かさ」の観点からアドバイスしてください。
-    
-    対象の文章:
-    {target_text}
-    """
-    response = llm.invoke([HumanMessage(content=prompt)])
+    # テンプレートに文章を埋め込んで批評させる
+    response = reflect_chain.invoke({"target_text": target_text})
     
     # 批評を返す（これが次のGeneratorへの入力になる）
     return {"messages": [response]}
@@ -89,24 +112,96 @@ builder.add_edge("reflector", "generator")
 
 graph = builder.compile()
 
+# 4-2. 別パターン: 並列に下書きを作って一番良いものを選ぶ（Best-of-N）
+# Reflection ループは「書く → 批評 → 書き直す」を順番に繰り返すため、LLM の往復がループ回数分かかります。
+# 代わりに Send API で下書きを NUM_DRAFTS 本同時に作り、1回の比較で一番良いものを選ぶと、
+# 待ち時間は「下書き1本分 + 比較1回分」で済みます。
+NUM_DRAFTS = 3
+
+class BestOfState(TypedDict):
+    messages: Annotated[list, add_messages]
+    # 各ブランチが作った下書き（並列に追記されるので operator.add で結合）
+    drafts: Annotated[List[str], operator.add]
+    best: str
+
+class DraftTask(TypedDict):
+    """Send で各 draft_writer に渡す入力"""
+    messages: list
+    seed: int
+
+class Judgement(BaseModel):
+    """Judge の選択結果"""
+    best_index: int = Field(description="最も優れた文章の番号（0始まり）")
+    reason: str = Field(description="その文章を選んだ理由（1文程度）")
+
+JUDGE_PROMPT = ChatPromptTemplate.from_messages([
+    ("human", """
+以下の{count}つの文章を「論理性」「具体性」「表現の豊かさ」の観点で比較し、最も優れたものを1つ選んでください。
+
+{drafts}
+"""),
+])
+judge_chain = JUDGE_PROMPT | llm.with_structured_output(Judgement)
+
+def distribute_drafts(state: BestOfState):
+    """下書きを書くブランチを NUM_DRAFTS 本に分岐させる"""
+    return [Send("draft_writer", {"messages": state["messages"], "seed": i}) for i in range(NUM_DRAFTS)]
+
+def draft_writer(task: DraftTask):
+    """下書きを1本作成するノード（NUM_DRAFTS 本が同時に動く）"""
+    print(f"\n[Draft Writer {task['seed']}] 下書きを作成中...")
+    # seed を変えることで、同じ指示からでも異なる下書きを作らせる
+    response = llm.invoke(task["messages"], seed=task["seed"])
+    return {"drafts": [response.content]}
+
+def judge(state: BestOfState):
+    """すべての下書きを比較して一番良いものを選ぶノード"""
+    print("\n[Judge] 下書きを比較中...")
+    drafts = state["drafts"]
+    drafts_text = "\n\n".join(f"[{i}]\n{draft}" for i, draft in enumerate(drafts))
+    decision: Judgement = judge_chain.invoke({"count": len(drafts), "drafts": drafts_text})
+    # 範囲外の番号が返ってきた場合は最初の下書きを使う
+    best_index = decision.best_index if 0 <= decision.best_index < len(drafts) else 0
+    print(f"  [Judge] 選択: {best_index}（理由: {decision.reason}）")
+    best = drafts[best_index]
+    return {"best": best, "messages": [AIMessage(content=best)]}
+
+best_of_builder = StateGraph(BestOfState)
+best_of_builder.add_node("draft_writer", draft_writer)
+best_of_builder.add_node("judge", judge)
+
+# START -> (Send で NUM_DRAFTS 本に分岐) -> draft_writer -> judge
+best_of_builder.add_conditional_edges(START, distribute_drafts, ["draft_writer"])
+best_of_builder.add_edge("draft_writer", "judge")
+best_of_builder.add_edge("judge", END)
+
+best_of_graph = best_of_builder.compile()
+
 # 5. 実行
-if __name__ == "__main__":
-    print("--- アプリケーション開始 ---")
-    
+def run_reflection_loop(task: HumanMessage):
+    """Reflection ループ（書く → 批評 → 書き直す）で実行する"""
     # 初期状態（loop_countを0で初期化）
     initial_state = {
-        "messages": [HumanMessage(content="「AIと人間の共存」について、300文字程度の短いエッセイを書いてください。")],
+        "messages": [task],
         "loop_count": 0
     }
     
     # 実行
+    # "messages" モードで LLM のトークンを、"updates" モードで各ノードの出力を受け取ります
     final_state = None
-    for event in graph.stream(initial_state):
-        for key, value in event.items():
+    for mode, payload in graph.stream(initial_state, stream_mode=["messages", "updates"]):
+        if mode == "messages":
+            # Generator の文章は全文の完成を待たず、トークンが届いた順に表示
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") == "generator" and chunk.content:
+                print(chunk.content, end="", flush=True)
+            continue
+
+        for key, value in payload.items():
             if "messages" in value:
                 last_msg = value["messages"][-1]
                 # 長すぎるので先頭だけ表示
-                print(f"Output from {key}: {last_msg.content[:50]}...")
+                print(f"\nOutput from {key}: {last_msg.content[:50]}...")
             
             # 最終状態を更新し続ける
             final_state = value
@@ -114,3 +209,21 @@ if __name__ == "__main__":
     print("\n--- 最終成果物 ---")
     if final_state and "messages" in final_state:
         print(final_state["messages"][-1].content)
+
+def run_best_of(task: HumanMessage):
+    """Best-of-N（並列に下書きを作って一番良いものを選ぶ）で実行する"""
+    final_state = best_of_graph.invoke({"messages": [task]})
+
+    print("\n--- 最終成果物 ---")
+    print(final_state["best"])
+
+if __name__ == "__main__":
+    print("--- アプリケーション開始 ---")
+
+    task = HumanMessage(content="「AIと人間の共存」について、300文字程度の短いエッセイを書いてください。")
+
+    # REFLECTION_MODE=best_of を指定すると、Best-of-N パターンで実行します
+    if os.getenv("REFLECTION_MODE") == "best_of":
+        run_best_of(task)
+    else:
+        run_reflection_loop(task)
@@ -21,14 +21,27 @@ LangSmith Integration（トレーシング・デバッグ）
      LANGCHAIN_PROJECT=langgraph-practice  # プロジェクト名（任意）
 """
 import asyncio
+import operator
+import sys
+from pathlib import Path
 from typing import TypedDict, Annotated, List
 from dotenv import load_dotenv
 import os
 
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from langchain_core.tracers.langchain import wait_for_all_tracers
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
+from langgraph.types import Send
+
+# リポジトリ直下の core/ を import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from core.llm_cache import SemanticCache
+from core.http_clients import get_http_client, get_async_http_client
+from core.sqlite_cache import SQLiteBackend, SQLiteCache
 
 # -------------------------------------------------
 # 1. 環境設定とLangSmithの有効化
@@ -39,10 +52,14 @@ load_dotenv()
 tracing_enabled = os.getenv("LANGCHAIN_TRACING_V2", "false").lower() == "true"
 api_key = os.getenv("LANGCHAIN_API_KEY")
 project_name = os.getenv("LANGCHAIN_PROJECT", "langgraph-practice")
+# 送信するトレースの割合（LangSmith クライアントがこの環境変数を読んで、実行ごとに送信するかを決める）
+sampling_rate = os.getenv("LANGCHAIN_TRACING_SAMPLING_RATE")
 
 if tracing_enabled and api_key:
     print(f"✅ LangSmith トレーシングが有効です")
     print(f"   プロジェクト名: {project_name}")
+    if sampling_rate:
+        print(f"   サンプリング率: {sampling_rate}（UI に表示されるのは一部の実行だけです）")
     print(f"   LangSmith UI: https://smith.langchain.com/\n")
 else:
     print("⚠️  LangSmith トレーシングが無効です")
@@ -51,7 +68,35 @@ else:
     print("   LANGCHAIN_API_KEY=your_api_key_here")
     print("   LANGCHAIN_PROJECT=langgraph-practice\n")
 
-llm = ChatOpenAI(model="gpt-4o-mini")
+# OpenAI へのリクエストはトークンバケット方式で秒間3回までに抑えます（researcher と finalizer で共有）
+# （キャッシュにヒットした呼び出しはリクエストを送らないので、制限の対象になりません）
+rate_limiter = InMemoryRateLimiter(requests_per_second=3, check_every_n_seconds=0.05, max_bucket_size=10)
+
+# researcher のプロンプトは固定の文に質問と観点を差し込むだけなので、意味的類似で判定すると
+# 別の質問・別の観点の回答を取り違えやすくなります。完全一致のときだけキャッシュを返します
+researcher_llm = ChatOpenAI(
+    model="gpt-4o-mini",
+    cache=SQLiteCache(),
+    rate_limiter=rate_limiter,
+    http_client=get_http_client(),
+    http_async_client=get_async_http_client(),
+)
+
+# finalizer は同じ質問だけでなく、リサーチ結果の言い回しが少し違うだけの入力にも前回のレスポンスを返します
+# （意味的類似で再利用するのは temperature=0 の呼び出しだけです）。
+# エントリは SQLite に保存するので、実行し直しても再利用できます
+finalizer_llm = ChatOpenAI(
+    model="gpt-4o-mini",
+    temperature=0,
+    cache=SemanticCache(backend=SQLiteBackend()),
+    rate_limiter=rate_limiter,
+    http_client=get_http_client(),
+    http_async_client=get_async_http_client(),
+)
+
+# STREAM_TOKENS=1 のときは質問を1つずつ実行し、finalizer の回答を生成されたそばから表示します
+# （同時に実行するとトークンが混ざって読めなくなるため、この場合は順番に実行します）
+STREAM_TOKENS = os.getenv("STREAM_TOKENS") == "1"
 
 # -------------------------------------------------
 # 2. State 定義
@@ -59,78 +104,73 @@ llm = ChatOpenAI(model="gpt-4o-mini")
 class State(TypedDict):
     messages: Annotated[List, add_messages]
     query: str
-    research_result: str
-    summary: str
+    # 各 researcher が調べた情報（並列に追記されるので operator.add で結合）
+    facts: Annotated[List[str], operator.add]
 
 # -------------------------------------------------
 # 3. ノード定義
 # -------------------------------------------------
 
-def researcher_node(state: State) -> dict:
-    """リサーチノード: 質問について情報を調べる"""
-    print("\n[Researcher] リサーチ中...")
-    
-    query = state.get("query", "")
-    
-    messages = [
-        SystemMessage(content="あなたは情報を調べる専門家です。質問に対して正確で有用な情報を提供してください。"),
-        HumanMessage(content=f"「{query}」について、重要な情報を3つ挙げてください。")
-    ]
-    
-    response = llm.invoke(messages)
-    research_result = response.content
-    
-    print(f"  ✅ [Researcher] 完了")
-    return {"research_result": research_result}
+class ResearchTask(TypedDict):
+    """Send で各 researcher に渡す入力"""
+    query: str
+    aspect: str
 
-def analyzer_node(state: State) -> dict:
-    """分析ノード: リサーチ結果を分析する"""
-    print("\n[Analyzer] 分析中...")
-    
-    query = state.get("query", "")
-    research_result = state.get("research_result", "")
-    
-    messages = [
-        SystemMessage(content="あなたは情報を分析する専門家です。リサーチ結果を分析し、要点をまとめてください。"),
-        HumanMessage(content=f"""
+# 1つのプロンプトで「重要な情報を3つ」挙げさせる代わりに、観点ごとに1つずつ同時に調べます
+# （1回あたりの出力が短くなるので、3つを順番に生成するより早く揃います）
+RESEARCH_ASPECTS = ["概要・定義", "利点・活用例", "注意点・課題"]
+
+# プロンプトはモジュール読み込み時に1回だけ組み立て、ノードでは {query} などの差し込みだけを行います
+# （システムプロンプトが毎回まったく同じ文字列になるので、OpenAI のプロンプトキャッシュにも当たりやすくなります）
+RESEARCHER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "あなたは情報を調べる専門家です。質問に対して正確で有用な情報を提供してください。"),
+    ("human", "「{query}」について、「{aspect}」の観点から重要な情報を1つ挙げてください。"),
+])
+
+FINALIZER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "あなたは情報を分析し、回答を整形する専門家です。リサーチ結果の要点をまとめ、分かりやすく読みやすい形式で回答してください。"),
+    ("human", """
 質問: {query}
 
 リサーチ結果:
-{research_result}
+{facts}
 
-上記のリサーチ結果を分析し、質問に対する回答を200文字程度でまとめてください。
-""")
-    ]
+上記のリサーチ結果を分析し、質問に対する回答を200文字程度でまとめたうえで、ユーザーへの最終回答として整形してください。
+"""),
+])
+
+def distribute_research(state: State):
+    """観点ごとに researcher を分岐させる"""
+    return [Send("researcher", {"query": state["query"], "aspect": aspect}) for aspect in RESEARCH_ASPECTS]
+
+async def researcher_node(task: ResearchTask) -> dict:
+    """リサーチノード: 質問について、1つの観点から情報を調べる（観点の数だけ同時に動く）"""
+    print(f"\n[Researcher] リサーチ中...（{task['aspect']}）")
     
-    response = llm.invoke(messages)
-    summary = response.content
+    messages = RESEARCHER_PROMPT.format_messages(query=task["query"], aspect=task["aspect"])
     
-    print(f"  ✅ [Analyzer] 完了")
-    return {"summary": summary}
+    response = await researcher_llm.ainvoke(messages)
+    
+    print(f"  ✅ [Researcher] 完了（{task['aspect']}）")
+    return {"facts": [f"【{task['aspect']}】\n{response.content}"]}
 
-def finalizer_node(state: State) -> dict:
-    """最終化ノード: 最終的な回答を整形する"""
+async def finalizer_node(state: State) -> dict:
+    """最終化ノード: リサーチ結果を分析し、最終的な回答を整形する"""
     print("\n[Finalizer] 最終化中...")
     
     query = state.get("query", "")
-    summary = state.get("summary", "")
+    facts = "\n\n".join(state.get("facts", []))
     
-    messages = [
-        SystemMessage(content="あなたは回答を整形する専門家です。分かりやすく読みやすい形式で回答を整形してください。"),
-        HumanMessage(content=f"""
-質問: {query}
-
-分析結果:
-{summary}
-
-上記の分析結果を元に、ユーザーへの最終回答を整形してください。
-""")
-    ]
+    # 分析（要点をまとめる）と整形は、1回の LLM 呼び出しでまとめて行います
+    # （別々のノードにすると、まとめた結果をそのまま LLM に送り返すだけの往復が1回増えるため）
+    messages = FINALIZER_PROMPT.format_messages(query=query, facts=facts)
     
-    response = llm.invoke(messages)
+    response = await finalizer_llm.ainvoke(messages)
     final_answer = response.content
     
-    print(f"  ✅ [Finalizer] 完了")
+    # STREAM_TOKENS=1 のときは回答そのものが表示されていくので、トークンの行に割り込まないよう完了ログは省く
+    if not STREAM_TOKENS:
+        print(f"  ✅ [Finalizer] 完了")
     return {"messages": [AIMessage(content=final_answer)]}
 
 # -------------------------------------------------
@@ -139,16 +179,58 @@ def finalizer_node(state: State) -> dict:
 builder = StateGraph(State)
 
 builder.add_node("researcher", researcher_node)
-builder.add_node("analyzer", analyzer_node)
 builder.add_node("finalizer", finalizer_node)
 
-builder.add_edge(START, "researcher")
-builder.add_edge("researcher", "analyzer")
-builder.add_edge("analyzer", "finalizer")
+# START -> (Send で観点ごとに分岐) -> researcher -> finalizer
+builder.add_conditional_edges(START, distribute_research, ["researcher"])
+builder.add_edge("researcher", "finalizer")
 builder.add_edge("finalizer", END)
 
 graph = builder.compile()
 
+# 同時に実行するパイプライン（質問）の数の上限
+# 1つのパイプラインが同時に送るリクエストは最大で観点の数（3件）なので、
+# 同時に飛ぶリクエスト数は MAX_CONCURRENT_QUERIES × 3 件までに収まります
+# （セマフォは最初に使ったイベントループに結び付くので、main() の中で作って run_one に渡します）
+MAX_CONCURRENT_QUERIES = 3
+
+async def run_one(query: str, semaphore: asyncio.Semaphore, stream_tokens: bool = False) -> str:
+    """1つの質問についてパイプラインを実行し、最終回答を返す
+
+    semaphore で同時に実行するパイプラインの数を制限する。
+    stream_tokens=True のときは、finalizer の回答をトークン単位で標準出力に表示する
+    """
+    initial_state = {
+        "messages": [HumanMessage(content=query)],
+        "query": query,
+        "facts": []
+    }
+
+    final_answer = ""
+    streamed = False
+    # "messages" を加えると、ノード内の LLM 呼び出しのトークンも (チャンク, メタデータ) として流れてきます
+    stream_mode = ["updates", "messages"] if stream_tokens else ["updates"]
+    async with semaphore:
+        # グラフを実行
+        # LangSmithが自動的に実行ログを記録します（同時に実行しても質問ごとに別のトレースになります）
+        # 必要なのは finalizer の出力だけなので、すべての内部イベントを流す astream_events ではなく、
+        # ノードが1つ終わるごとに { ノード名: 更新内容 } だけを受け取る stream_mode="updates" を使います
+        async for mode, data in graph.astream(initial_state, stream_mode=stream_mode):
+            if mode == "messages":
+                chunk, metadata = data
+                # finalizer の LLM が生成したトークンだけを表示する（researcher の出力は途中経過なので表示しない）
+                if isinstance(chunk, AIMessageChunk) and metadata.get("langgraph_node") == "finalizer":
+                    if not streamed:
+                        print("\n[Final Answer]")
+                        streamed = True
+                    print(chunk.content, end="", flush=True)
+            elif "finalizer" in data:
+                final_answer = data["finalizer"]["messages"][-1].content
+    if stream_tokens and not streamed:
+        # キャッシュにヒットした場合はトークン単位では流れてこないので、まとめて表示する
+        print(f"\n[Final Answer]\n{final_answer}", end="")
+    return final_answer
+
 # -------------------------------------------------
 # 5. 実行
 # -------------------------------------------------
@@ -165,38 +247,32 @@ async def main():
         "エラーハンドリングのベストプラクティスは？"
     ]
     
-    for i, query in enumerate(test_queries, 1):
-        print(f"\n{'='*60}")
-        print(f"ケース{i}: {query}")
-        print(f"{'='*60}\n")
-        
-        initial_state = {
-            "messages": [HumanMessage(content=query)],
-            "query": query,
-            "research_result": "",
-            "summary": ""
-        }
-        
-        # グラフを実行
-        # LangSmithが自動的に実行ログを記録します
-        final_state = None
-        async for event in graph.astream_events(initial_state, version="v1"):
-            if event["event"] == "on_chain_end":
-                name = event.get("name", "")
-                if name == "finalizer":
-                    output = event["data"]["output"]
-                    if "messages" in output and output["messages"]:
-                        last_msg = output["messages"][-1]
-                        if isinstance(last_msg, AIMessage):
-                            print(f"\n[Final Answer]\n{last_msg.content}")
-        
-        print("\n" + "-"*60)
-        
-        # テストケース間で少し待機（APIレート制限対策）
-        if i < len(test_queries):
-            await asyncio.sleep(1)
+    query_semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+    if STREAM_TOKENS:
+        for i, query in enumerate(test_queries, 1):
+            print(f"\n{'='*60}")
+            print(f"ケース{i}: {query}")
+            print(f"{'='*60}")
+            await run_one(query, query_semaphore, stream_tokens=True)
+            print("\n" + "-"*60)
+    else:
+        # 各質問は互いに独立しているので、まとめて同時に実行します
+        # （待ち時間は「全質問の合計」ではなく「最も遅い質問1つ分」になる。途中経過のログは混ざります）
+        # 同時実行数は run_one の中のセマフォで制限しているので、順番に sleep を挟む必要はありません
+        tasks = [asyncio.create_task(run_one(query, query_semaphore)) for query in test_queries]
+        final_answers = await asyncio.gather(*tasks)
+
+        for i, (query, final_answer) in enumerate(zip(test_queries, final_answers), 1):
+            print(f"\n{'='*60}")
+            print(f"ケース{i}: {query}")
+            print(f"{'='*60}\n")
+            print(f"[Final Answer]\n{final_answer}")
+            print("\n" + "-"*60)
     
     if tracing_enabled:
+        # トレースは実行中にバックグラウンドのスレッドからまとめて送信されています（LLM 呼び出しを待たせない）
+        # プログラムの終了で送信待ちのトレースが失われないよう、ここで送信が終わるのを待ちます
+        wait_for_all_tracers()
         print(f"\n{'='*60}")
         print("📊 LangSmith UIで詳細を確認:")
         print(f"   https://smith.langchain.com/o/{os.getenv('LANGCHAIN_ORG_ID', 'default')}/projects/p/{project_name}")
@@ -0,0 +1,37 @@
+"""
+OpenAI API 用の共有 HTTP クライアント（HTTP/2 + 接続プール）
+
+`ChatOpenAI` は何も指定しないと、プロセス内で共通の httpx クライアント（HTTP/1.1）を使います。
+HTTP/1.1 では同時に送るリクエストの数だけ TLS 接続が必要になるため、
+`asyncio.gather` や `Send` で LLM を並列に呼ぶボットでは、そのたびに接続の確立（TLS ハンドシェイク）が発生します。
+このモジュールのクライアントは HTTP/2 を有効にしているので、同時リクエストが1本の接続に多重化されます。
+
+    llm = ChatOpenAI(
+        model="gpt-4o-mini",
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+のように渡すだけで使えます（HTTP/2 には `h2` パッケージが必要です）。
+"""
+from functools import lru_cache
+
+import httpx
+
+# 接続プールの上限。keepalive_expiry の間はアイドルな接続も閉じずに使い回す
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=32, keepalive_expiry=60.0)
+
+
+@lru_cache(maxsize=None)
+def get_http_client() -> httpx.Client:
+    """同期呼び出し（invoke）用の共有クライアントを返す"""
+    return httpx.Client(limits=HTTP_LIMITS, http2=True)
+
+
+@lru_cache(maxsize=None)
+def get_async_http_client() -> httpx.AsyncClient:
+    """非同期呼び出し（ainvoke）用の共有クライアントを返す
+
+    接続は最初に使ったイベントループに結び付くので、1プロセスで `asyncio.run` を1回だけ呼ぶ前提です。
+    """
+    return httpx.AsyncClient(limits=HTTP_LIMITS, http2=True)
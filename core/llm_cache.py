@@ -0,0 +1,178 @@
+"""
+LLM レスポンスキャッシュ（完全一致 + 意味的類似）
+
+開発中は同じようなプロンプトで何度もボットを実行するため、毎回 OpenAI に
+問い合わせると待ち時間もコストも無駄になります。
+このモジュールは LangChain の `BaseCache` を実装したキャッシュで、
+`ChatOpenAI(cache=SemanticCache())` のように渡すだけで使えます。
+
+【仕組み】
+1. モデル設定 + メッセージ全体の sha256 が一致すれば、そのまま返す（完全一致）
+2. 一致しなければ、直前までの会話履歴が同じエントリに限定して、
+   最後のメッセージの埋め込みベクトルのコサイン類似度を比較する
+3. 類似度が threshold 以上で、数値や英単語（123、Python など）もすべて同じエントリがあれば、その回答を返す
+
+意味的類似による再利用（2〜3）は、temperature=0 でツールを使わない呼び出しのときだけ行います。
+temperature が 0 でなければ同じプロンプトでも毎回違う回答が期待されていますし、
+ツール呼び出しの引数は1文字違うだけで結果が変わるためです。それ以外の呼び出しは完全一致のみになります。
+
+会話履歴が異なる場合（例: タイムトラベルで分岐した後）は類似判定の対象外になるため、
+別の世界線の回答が返ってくることはありません。
+
+なお、固定の指示文に質問やトピックを差し込むだけのプロンプト（「以下の計算を実行してください: {式}」など）は、
+指示文の部分が類似度の大半を占めてしまい、差し込んだ部分が違っても類似ヒットしやすくなります。
+そうした呼び出しには完全一致のみのキャッシュ（`core.sqlite_cache.SQLiteCache` など）を使ってください。
+"""
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, List, MutableMapping, Optional, Sequence, Tuple
+
+import numpy as np
+from cachetools import LRUCache, TTLCache
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.embeddings import Embeddings
+
+# 数値や英単語など、1文字違うだけで意味が変わる部分（類似ヒットには完全一致を求める）
+_LITERAL_PATTERN = re.compile(r"[0-9A-Za-z]+(?:\.[0-9A-Za-z]+)*")
+# llm_string（モデル設定 + 呼び出し時の引数）に含まれる temperature の値
+_TEMPERATURE_PATTERN = re.compile(r"""["']temperature["']\s*[:,]\s*(-?[0-9.]+)""")
+
+
+@dataclass
+class _Entry:
+    context_key: str
+    vector: Optional[np.ndarray]
+    generations: RETURN_VAL_TYPE
+    literals: Tuple[str, ...] = ()
+
+
+def _sha256(*parts: str) -> str:
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _message_text(message: dict) -> str:
+    """シリアライズ済みメッセージから本文だけを取り出す"""
+    content = message.get("kwargs", {}).get("content", "")
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, ensure_ascii=False, sort_keys=True)
+
+
+def _literals(text: str) -> Tuple[str, ...]:
+    """本文に含まれる数値・英単語を出現順に取り出す"""
+    return tuple(token.lower() for token in _LITERAL_PATTERN.findall(text))
+
+
+def _allows_semantic(llm_string: str) -> bool:
+    """意味的類似による再利用をしてよい呼び出しか（temperature=0 かつツールなし）"""
+    # 呼び出し時の引数はモデル設定の後ろに付くので、最後に見つかった値が実際に使われる temperature
+    temperatures = _TEMPERATURE_PATTERN.findall(llm_string)
+    if not temperatures or float(temperatures[-1]) != 0:
+        return False
+    return "('tools'," not in llm_string
+
+
+class SemanticCache(BaseCache):
+    """完全一致 → 意味的類似 の順で検索する LLM キャッシュ
+
+    Args:
+        embedder: 埋め込みモデル。省略時は `OpenAIEmbeddings(model="text-embedding-3-small")`
+        backend: エントリの保存先。省略時は `cachetools.TTLCache`。
+            Redis などを使いたい場合は MutableMapping を実装したものを渡す。
+            `candidates(context_key)` メソッドを持つ backend は、類似判定の候補（キー・ベクトル・数値/英単語）を
+            レスポンス本体を読み込まずに返せるので、エントリ数が多くても検索が軽くなる
+        threshold: 類似ヒットとみなすコサイン類似度の下限
+        ttl: エントリの有効期限（秒）。backend を省略したときのみ使用
+        maxsize: 保持するエントリ数の上限。backend を省略したときのみ使用
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[Embeddings] = None,
+        backend: Optional[MutableMapping[str, _Entry]] = None,
+        threshold: float = 0.92,
+        ttl: float = 3600,
+        maxsize: int = 256,
+    ):
+        if embedder is None:
+            # OpenAI のキーが必要なので、実際に使うときだけ import する
+            from langchain_openai import OpenAIEmbeddings
+            embedder = OpenAIEmbeddings(model="text-embedding-3-small")
+        self.embedder = embedder
+        self.backend = backend if backend is not None else TTLCache(maxsize=maxsize, ttl=ttl)
+        self.threshold = threshold
+        # lookup（ミス）で計算した埋め込みを update で再利用するための一時置き場
+        # LLM 呼び出しが失敗して update が呼ばれなかった分が溜まり続けないよう、件数に上限を設ける
+        self._pending: MutableMapping[str, np.ndarray] = LRUCache(maxsize=64)
+
+    def _keys(self, prompt: str, llm_string: str) -> tuple[str, str, str]:
+        messages: Sequence[dict] = json.loads(prompt)
+        exact_key = _sha256(llm_string, prompt)
+        context_key = _sha256(llm_string, json.dumps(messages[:-1], sort_keys=True))
+        last_text = _message_text(messages[-1]) if messages else ""
+        return exact_key, context_key, last_text
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        try:
+            vector = np.asarray(self.embedder.embed_query(text), dtype=np.float32)
+        except Exception as e:
+            # 埋め込みに失敗しても LLM 呼び出し自体は続行する（完全一致のみになる）
+            print(f"  ⚠️  [SemanticCache] 埋め込みの取得に失敗しました: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _candidates(self, context_key: str) -> List[Tuple[str, np.ndarray, Tuple[str, ...]]]:
+        """同じ会話履歴を持つエントリの (キー, ベクトル, 数値/英単語) を返す"""
+        candidates = getattr(self.backend, "candidates", None)
+        if candidates is not None:
+            return candidates(context_key)
+        return [
+            (key, e.vector, e.literals) for key, e in list(self.backend.items())
+            if e.context_key == context_key and e.vector is not None
+        ]
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        exact_key, context_key, last_text = self._keys(prompt, llm_string)
+
+        # 1. 完全一致
+        entry = self.backend.get(exact_key)
+        if entry is not None:
+            return entry.generations
+        if not _allows_semantic(llm_string):
+            return None
+
+        # 2. 同じ会話履歴を持ち、数値や英単語もすべて同じエントリだけを候補にする
+        literals = _literals(last_text)
+        candidates = [(key, vector) for key, vector, lits in self._candidates(context_key) if lits == literals]
+        vector = self._embed(last_text)
+        if vector is None:
+            return None
+
+        # 3. 正規化済みベクトル同士の内積 = コサイン類似度
+        if candidates:
+            scores = np.stack([v for _, v in candidates]) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                hit = self.backend.get(candidates[best][0])
+                if hit is not None:
+                    return hit.generations
+
+        # ミスした場合だけ、計算した埋め込みを update で使えるよう取っておく
+        self._pending[exact_key] = vector
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        exact_key, context_key, last_text = self._keys(prompt, llm_string)
+        vector = None
+        if _allows_semantic(llm_string):
+            vector = self._pending.pop(exact_key, None)
+            if vector is None:
+                vector = self._embed(last_text)
+        self.backend[exact_key] = _Entry(context_key, vector, return_val, _literals(last_text))
+
+    def clear(self, **kwargs: Any) -> None:
+        self.backend.clear()
+        self._pending.clear()
@@ -0,0 +1,216 @@
+"""
+LLM レスポンスの永続キャッシュ（完全一致 / SQLite）
+
+`SemanticCache` はプロセス内（メモリ上）のキャッシュなので、スクリプトを実行し直すと空に戻ります。
+教材のボットは毎回同じ入力（「こんにちは」「コーヒーの健康効果」など）で実行し直すことが多いため、
+このモジュールではレスポンスを SQLite ファイルに保存し、次回の実行でも再利用できるようにします。
+`ChatOpenAI(cache=SQLiteCache())` のように渡すだけで使えます。
+
+【仕組み】
+- モデル設定 + メッセージ全体の sha256 をキーに、レスポンスを JSON で保存する
+- 完全一致のときだけ返す（埋め込みの計算は行わないので、ミス時の追加コストはほぼゼロ）
+
+キャッシュを消したいときは、DB ファイル（デフォルトはリポジトリ直下の `.llm_cache.db`）を削除してください。
+
+また `SQLiteBackend` は `SemanticCache` の保存先（backend）として使える MutableMapping です。
+`SemanticCache(backend=SQLiteBackend())` とすると、意味的類似キャッシュも実行をまたいで再利用できます。
+埋め込みベクトルはレスポンスとは別の列に保存し、エントリには有効期限と件数の上限を設けています。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import warnings
+from pathlib import Path
+from typing import Any, Iterator, List, MutableMapping, Optional, Tuple, Union
+
+import numpy as np
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+from pydantic import BaseModel
+
+from core.llm_cache import _Entry
+
+DEFAULT_DATABASE_PATH = Path(__file__).resolve().parents[1] / ".llm_cache.db"
+
+
+def _dumps(return_val: RETURN_VAL_TYPE) -> str:
+    """レスポンスを JSON 文字列にする
+
+    Structured Output のレスポンスは、パース済みの Pydantic オブジェクトを
+    `message.additional_kwargs["parsed"]` に持っていて、そのままでは `loads` で復元できません。
+    dict に変換してから保存します（langchain-openai は dict の parsed からスキーマを組み立て直します）。
+    呼び出し元に返すレスポンスは書き換えないよう、変換はコピーに対して行います。
+    """
+    generations = []
+    for generation in return_val:
+        message = getattr(generation, "message", None)
+        parsed = message.additional_kwargs.get("parsed") if message is not None else None
+        if isinstance(parsed, BaseModel):
+            additional_kwargs = {**message.additional_kwargs, "parsed": parsed.model_dump(mode="json")}
+            message = message.model_copy(update={"additional_kwargs": additional_kwargs})
+            generation = generation.model_copy(update={"message": message})
+        generations.append(generation)
+    return dumps(generations)
+
+
+def _loads(serialized: str) -> Optional[RETURN_VAL_TYPE]:
+    """`dumps` で保存したレスポンスを読み込む（読み込めなければ None）"""
+    try:
+        # langchain_core.load.loads はベータ扱いで毎回警告が出るため、ここでは抑制する
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message=".*`loads` is in beta.*")
+            return loads(serialized)
+    except Exception:
+        # ライブラリの更新などで読み込めなくなった古いエントリは、ミス扱いにして上書きさせる
+        return None
+
+
+class SQLiteCache(BaseCache):
+    """SQLite ファイルに保存する、完全一致のみの LLM キャッシュ
+
+    Args:
+        database_path: DB ファイルのパス。省略時はリポジトリ直下の `.llm_cache.db`
+    """
+
+    def __init__(self, database_path: Union[str, Path] = DEFAULT_DATABASE_PATH):
+        # LangGraph は同期ノードを別スレッドで実行することがあるので、
+        # 1つの接続をロック付きで共有する
+        self.conn = sqlite3.connect(str(database_path), check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, generations TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT generations FROM llm_cache WHERE key = ?", (self._key(prompt, llm_string),)
+            ).fetchone()
+        return _loads(row[0]) if row is not None else None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, generations) VALUES (?, ?)",
+                (self._key(prompt, llm_string), _dumps(return_val)),
+            )
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM llm_cache")
+
+
+class SQLiteBackend(MutableMapping[str, _Entry]):
+    """`SemanticCache` のエントリを SQLite ファイルに保存する backend
+
+    埋め込みベクトル（float32 のバイト列）・数値/英単語・レスポンス（JSON）はそれぞれ別の列に保存します。
+    類似判定の候補は `candidates()` で同じ会話履歴の行のベクトルだけを読み込むので、
+    lookup のたびにレスポンスまで読み込むことはありません。
+
+    Args:
+        database_path: DB ファイルのパス。省略時はリポジトリ直下の `.llm_cache.db`（`SQLiteCache` とは別テーブル）
+        ttl: エントリの有効期限（秒）。期限切れのエントリは読み込まず、書き込み時に削除する
+        maxsize: 保持するエントリ数の上限。超えた分は古いものから削除する
+    """
+
+    def __init__(
+        self,
+        database_path: Union[str, Path] = DEFAULT_DATABASE_PATH,
+        ttl: float = 7 * 24 * 3600,
+        maxsize: int = 1024,
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.conn = sqlite3.connect(str(database_path), check_same_thread=False)
+        with self.conn:
+            # 以前のバージョンのエントリ（pickle で1列にまとめていたもの）は読み込めないので削除する
+            self.conn.execute("DROP TABLE IF EXISTS semantic_cache")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS semantic_cache_entries ("
+                "key TEXT PRIMARY KEY, context_key TEXT NOT NULL, vector BLOB, "
+                "literals TEXT NOT NULL, generations TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS semantic_cache_entries_context "
+                "ON semantic_cache_entries (context_key)"
+            )
+        self._lock = threading.Lock()
+
+    def _expires_before(self) -> float:
+        return time.time() - self.ttl
+
+    def candidates(self, context_key: str) -> List[Tuple[str, np.ndarray, Tuple[str, ...]]]:
+        """同じ会話履歴を持つ有効なエントリの (キー, ベクトル, 数値/英単語) を返す"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT key, vector, literals FROM semantic_cache_entries "
+                "WHERE context_key = ? AND vector IS NOT NULL AND created_at >= ?",
+                (context_key, self._expires_before()),
+            ).fetchall()
+        return [
+            (key, np.frombuffer(vector, dtype=np.float32), tuple(json.loads(literals)))
+            for key, vector, literals in rows
+        ]
+
+    def __getitem__(self, key: str) -> _Entry:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT context_key, vector, literals, generations FROM semantic_cache_entries "
+                "WHERE key = ? AND created_at >= ?",
+                (key, self._expires_before()),
+            ).fetchone()
+        generations = _loads(row[3]) if row is not None else None
+        if generations is None:
+            raise KeyError(key)
+        context_key, vector, literals, _ = row
+        vector = np.frombuffer(vector, dtype=np.float32) if vector is not None else None
+        return _Entry(context_key, vector, generations, tuple(json.loads(literals)))
+
+    def __setitem__(self, key: str, value: _Entry) -> None:
+        vector = value.vector.astype(np.float32).tobytes() if value.vector is not None else None
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO semantic_cache_entries "
+                "(key, context_key, vector, literals, generations, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, value.context_key, vector, json.dumps(value.literals), _dumps(value.generations), time.time()),
+            )
+            # 期限切れのエントリと、上限を超えた古いエントリを削除する
+            self.conn.execute(
+                "DELETE FROM semantic_cache_entries WHERE created_at < ?", (self._expires_before(),)
+            )
+            self.conn.execute(
+                "DELETE FROM semantic_cache_entries WHERE key NOT IN "
+                "(SELECT key FROM semantic_cache_entries ORDER BY created_at DESC LIMIT ?)",
+                (self.maxsize,),
+            )
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock, self.conn:
+            deleted = self.conn.execute("DELETE FROM semantic_cache_entries WHERE key = ?", (key,)).rowcount
+        if not deleted:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            keys = [
+                row[0] for row in self.conn.execute(
+                    "SELECT key FROM semantic_cache_entries WHERE created_at >= ?", (self._expires_before(),)
+                )
+            ]
+        return iter(keys)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM semantic_cache_entries WHERE created_at >= ?", (self._expires_before(),)
+            ).fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM semantic_cache_entries")